@@ -0,0 +1,74 @@
+"""times JSONModel.json against the reflective serializer it replaced
+
+run from /backend with
+
+    python -m bench.serializers [n]
+"""
+import os
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+# finnance creates its database on import, point it to a scratch file first
+os.environ['FLASK_DEBUG'] = '1'
+os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+import sqlalchemy
+from finnance.models import Account, Agent, Currency, Transaction, User
+
+from finnance import app, db
+
+
+def legacy_json(obj, deep: bool):
+    """JSONModel.json before the serializers were compiled per class"""
+    d = {
+        key: obj.jsonValue(value)
+        for key, value in obj.__dict__.items()
+        if not (key.startswith('_') or key in obj.json_ignore
+                or isinstance(value, db.Model) or isinstance(value, sqlalchemy.orm.collections.InstrumentedList))
+    }
+    # properties
+    d.update({
+        key: obj.jsonValue(getattr(obj, key))
+        for key in vars(type(obj))
+        if isinstance(getattr(type(obj), key), property)
+    })
+    d["type"] = type(obj).__name__.lower()
+    if deep:
+        d.update({
+            key: obj.jsonValue(getattr(obj, key))
+            for key in obj.json_relations
+        })
+    return d
+
+def seed(n: int):
+    user = User(username='bench', email='bench@example.com', password='-')
+    currency = Currency(code='CHF', decimals=2, user=user)
+    account = Account(desc='bench', starting_saldo=0, date_created=datetime(2020, 1, 1),
+                      currency=currency, user=user, color='#aabbcc', order=1)
+    agents = [Agent(desc=f'agent{i}', user=user) for i in range(20)]
+    db.session.add_all([user, currency, account, *agents])
+    db.session.flush()
+    db.session.add_all([
+        Transaction(amount=100 + i, is_expense=i % 3 > 0, currency_id=currency.id,
+                    account_id=account.id, agent_id=agents[i % 20].id, comment=f'#{i}',
+                    user_id=user.id, date_issued=datetime(2020, 1, 1) + timedelta(hours=i))
+        for i in range(n)
+    ])
+    db.session.commit()
+
+def bench(transactions: list[Transaction]):
+    # shallow, the nested objects of deep would mostly time their own queries
+    assert [legacy_json(t, False) for t in transactions] == [t.json(False) for t in transactions]
+    for name, serialize in [('legacy', legacy_json), ('compiled', Transaction.json)]:
+        seconds = min(timeit.repeat(
+            lambda: [serialize(t, False) for t in transactions], number=1, repeat=5))
+        print(f"{name:8} {seconds * 1000:8.1f} ms")
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with app.app_context():
+        seed(n)
+        print(f"serializing {n} transactions, best of 5")
+        bench(Transaction.query.all())
@@ -1,12 +1,16 @@
 # Import flask and template operators
 import json
+import os
 import traceback
 from http import HTTPStatus
 
-from flask import Blueprint, Flask, current_app, request
+import sqlalchemy
+from alembic.script import ScriptDirectory
+from flask import Blueprint, Flask, current_app, has_request_context, request
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
-from flask_login import LoginManager
+from flask_login import LoginManager, current_user
+from flask_migrate import Migrate, upgrade
 from flask_sqlalchemy import SQLAlchemy
 from jsonschema import Draft202012Validator, ValidationError
 
@@ -24,10 +28,16 @@ login_manager = LoginManager(app)
 # Define the database object which is imported
 # by modules and controllers
 db = SQLAlchemy(app)
+migrate = Migrate(app, db, directory=os.path.join(app.root_path, 'migrations'))
 from . import models
 
+# the schema is versioned in finnance/migrations, every start upgrades the
+# database to the latest revision (gunicorn --preload runs this once)
 with app.app_context():
-    db.create_all()
+    upgrade()
+    # ETags change with the schema revision
+    app.config['SCHEMA_REVISION'] = ScriptDirectory.from_config(
+        migrate.get_config()).get_current_head()
 
 
 from finnance.accounts import accounts
@@ -42,6 +52,14 @@ from finnance.nivo import nivo
 from finnance.templates import templates
 from finnance.flows import flows
 from finnance.records import records
+from finnance.export import export
+from finnance.ledger import ledger_cli
+from finnance.rollup import rollup_cli
+from finnance.closure import closure_cli
+from finnance.usage import usage_cli
+from finnance.indexes import indexes_cli
+from finnance.cache import bump_version
+from finnance.models import JSONModel
 
 # Register blueprints
 app.register_blueprint(auth)
@@ -55,6 +73,43 @@ app.register_blueprint(nivo)
 app.register_blueprint(templates)
 app.register_blueprint(flows)
 app.register_blueprint(records)
+app.register_blueprint(export)
+
+# CLI commands
+app.cli.add_command(ledger_cli)
+app.cli.add_command(rollup_cli)
+app.cli.add_command(closure_cli)
+app.cli.add_command(usage_cli)
+app.cli.add_command(indexes_cli)
+
+# unchanged responses are answered before the view runs any query
+@app.before_request
+def not_modified():
+    if (request.method == 'GET' and request.if_none_match
+            and current_user.is_authenticated):
+        etag = JSONModel.etag()
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=HTTPStatus.NOT_MODIFIED)
+            response.set_etag(etag)
+            return response
+
+# every successful write invalidates the user's cached responses
+@app.after_request
+def bump_data_version(response):
+    if (request.method in ['POST', 'PUT', 'DELETE'] and response.status_code < 400
+            and current_user.is_authenticated):
+        bump_version(current_user.id)
+    return response
+
+# while developing, reads that lazy load a relationship fail instead of
+# silently running one query per row
+if app.config['RAISE_ON_LAZY_LOAD']:
+    @sqlalchemy.event.listens_for(db.session, 'do_orm_execute')
+    def raise_on_lazy_load(state):
+        if (has_request_context() and request.method == 'GET'
+                and state.lazy_loaded_from is not None):
+            mapper = state.lazy_loaded_from.mapper.class_.__name__
+            raise RuntimeError(f"lazy load from {mapper} in {request.path}")
 
 # ERROR HANDLING
 ################
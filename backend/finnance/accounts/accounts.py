@@ -3,31 +3,59 @@ from datetime import datetime
 from http import HTTPStatus
 
 from finnance.errors import APIError, validate
-from finnance.models import Account, Currency, JSONModel
-from finnance.params import parseSearchParams
+from finnance.ledger import drop, saldos_at, shift
+from finnance.models import Account, AccountTransfer, Currency, JSONModel, Transaction
+from finnance.params import AccountDate, parseSearchParams
+from finnance.rollup import contributions, update
+from finnance.usage import agent_uses, update_uses
 from flask import Blueprint, jsonify, request
 from flask_login import current_user, login_required
 
-from finnance import db
+from finnance import app, db
 
 accounts = Blueprint('accounts', __name__, url_prefix='/api/accounts')
 
 @accounts.route("")
 @login_required
 def all_accounts():
-    accs = Account.query.filter_by(
+    accs = Account.query.options(*Account.loaders()).filter_by(
         user_id=current_user.id).order_by(Account.order.asc()).all()
+    Account.load_saldos(accs)
     return JSONModel.obj_to_api([acc.json(deep=True) for acc in accs])
 
 @accounts.route("/<int:account_id>")
 @login_required
 def account(account_id):
-    acc = Account.query.filter_by(
+    acc = Account.query.options(*Account.loaders()).filter_by(
         user_id=current_user.id, id=account_id).first()
     if acc is None:
         raise APIError(HTTPStatus.NOT_FOUND)
     return acc.api()
 
+@accounts.route("/saldos")
+@login_required
+def saldos():
+    try:
+        points = [AccountDate(param) for param in request.args.getlist('at')]
+    except ValueError:
+        raise APIError(HTTPStatus.BAD_REQUEST, 'invalid search param at')
+    if len(points) > app.config['SALDO_POINTS_MAX']:
+        raise APIError(HTTPStatus.BAD_REQUEST,
+                       f"at most {app.config['SALDO_POINTS_MAX']} saldos per request")
+
+    accs = {acc.id: acc for acc in Account.query.filter(
+        Account.user_id == current_user.id,
+        Account.id.in_({point.account_id for point in points})
+    )}
+    if any(point.account_id not in accs for point in points):
+        raise APIError(HTTPStatus.BAD_REQUEST, 'invalid account_id')
+
+    values = saldos_at([(accs[point.account_id], point.date) for point in points])
+    return JSONModel.obj_to_api([
+        dict(account_id=point.account_id, date=point.date, saldo=saldo)
+        for point, saldo in zip(points, values)
+    ])
+
 @accounts.route("/<int:account_id>/changes")
 @login_required
 def changes(account_id):
@@ -80,14 +108,19 @@ def edit_account(account_id: int, **data):
     if 'starting_saldo' in data:
         if data['starting_saldo'] < 0:
             raise APIError(HTTPStatus.BAD_REQUEST, "negative starting_saldo")
+        shift(account, data['starting_saldo'] - account.starting_saldo)
         account.starting_saldo = data['starting_saldo']
 
     if 'currency_id' in data:
         if Currency.query.filter_by(user_id=current_user.id, id=data['currency_id']).first() is None:
             raise APIError(HTTPStatus.BAD_REQUEST, "invalid currency_id")
+        before = [c for trans in account.transactions for c in contributions(trans)]
         account.currency_id = data['currency_id']
         for trans in account.transactions:
             trans.currency_id = data['currency_id']
+        update(removed=before, added=[
+            c for trans in account.transactions for c in contributions(trans)
+        ])
         
     db.session.commit()
     return '', HTTPStatus.CREATED
@@ -170,9 +203,10 @@ def account_dependencies(account_id: int):
     if acc is None:
         raise APIError(HTTPStatus.NOT_FOUND)
     
-    total = len(acc.transactions)
-    total += len(acc.in_transfers)
-    total += len(acc.out_transfers)
+    # counted in the database, the collections are not loaded for GET requests
+    total = Transaction.query.filter_by(account_id=acc.id).count()
+    total += AccountTransfer.query.filter_by(dst_id=acc.id).count()
+    total += AccountTransfer.query.filter_by(src_id=acc.id).count()
 
     return jsonify(total)
 
@@ -183,6 +217,9 @@ def delete_account(account_id: int):
     if acc is None:
         raise APIError(HTTPStatus.NOT_FOUND)
     
+    drop(acc)
+    update(removed=[c for trans in acc.transactions for c in contributions(trans)])
+    uses = [u for trans in acc.transactions for u in agent_uses(trans)]
     for trans in acc.transactions:
         for flow in trans.flows:
             db.session.delete(flow)
@@ -194,6 +231,7 @@ def delete_account(account_id: int):
     for tf in acc.out_transfers:
         db.session.delete(tf)
     db.session.delete(acc)
+    update_uses(removed=uses)
     db.session.commit()
 
     return jsonify({}), HTTPStatus.OK
\ No newline at end of file
@@ -1 +1 @@
-from .agents import agents, create_agent_ifnx
\ No newline at end of file
+from .agents import agents, resolve_agents
\ No newline at end of file
@@ -2,8 +2,8 @@ from http import HTTPStatus
 
 import sqlalchemy
 from finnance.errors import APIError
-from finnance.models import Agent, Flow, JSONModel, Transaction
-from flask import Blueprint
+from finnance.models import Agent, AgentUsage, JSONModel
+from flask import Blueprint, request
 from flask_login import current_user, login_required
 
 from finnance import db
@@ -13,26 +13,72 @@ agents = Blueprint('agents', __name__, url_prefix='/api/agents')
 @agents.route("")
 @login_required
 def all_agents():
-    agents = Agent.query.filter_by(user_id=current_user.id).join(Transaction, isouter=True).join(
-        Flow, sqlalchemy.and_(Agent.id == Flow.agent_id, 
-        Transaction.id == Flow.trans_id), isouter=True).group_by(
-            Agent.id).order_by(Agent.uses.desc(), Agent.desc)
-    return JSONModel.obj_to_api([agent.desc for agent in agents])
+    # ranked by the maintained counters, every agent gets its row when it is
+    # created. ix_agent_usage_order serves the order, ties go to newer agents.
+    agents = Agent.query.select_from(AgentUsage).join(Agent, Agent.id == AgentUsage.agent_id).filter(
+        AgentUsage.user_id == current_user.id
+    ).order_by(AgentUsage.uses.desc(), AgentUsage.agent_id.desc())
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        if limit < 1:
+            raise APIError(HTTPStatus.BAD_REQUEST, "limit must be at least 1")
+        agents = agents.limit(limit)
+    return JSONModel.stream_api(agents, lambda agent: agent.desc)
 
 @agents.route("/<int:agent_id>")
 @login_required
 def agent(agent_id):
-    agent = Agent.query.filter_by(user_id=current_user.id, id=agent_id).order_by(Agent.desc).first()
+    agent = Agent.query.options(*Agent.loaders()).filter_by(
+        user_id=current_user.id, id=agent_id).order_by(Agent.desc).first()
     if agent is None:
         raise APIError(HTTPStatus.NOT_FOUND)
     return agent.api()
 
-def create_agent_ifnx(agent_desc):
-    if agent_desc is None:
-        return None
-    agent = Agent.query.filter_by(desc=agent_desc, user_id=current_user.id).first()
-    if not agent:
-        agent = Agent(desc=agent_desc, user_id=current_user.id)
-        db.session.add(agent)
-        db.session.commit()
-    return agent
\ No newline at end of file
+def _locked_agent(desc: str) -> Agent | None:
+    """agent of the current user by desc, including ones committed by other
+    workers after this transaction started"""
+    # a plain select reads the snapshot of the transaction under InnoDB's
+    # REPEATABLE READ, a locking read sees the latest committed row
+    return Agent.query.filter_by(desc=desc, user_id=current_user.id
+                                 ).with_for_update(read=True).first()
+
+def resolve_agents(descs) -> dict[str, Agent]:
+    """agents of the current user by desc, missing ones are inserted but not committed"""
+    # keeps the order of descs, new agents get their ids in that order
+    descs = list(dict.fromkeys(descs))
+    if not descs:
+        return {}
+    query = Agent.query.filter(Agent.user_id == current_user.id, Agent.desc.in_(descs))
+    agents = {agent.desc: agent for agent in query}
+    missing = [desc for desc in descs if desc not in agents]
+    if not missing:
+        return agents
+
+    try:
+        with db.session.begin_nested():
+            db.session.execute(sqlalchemy.insert(Agent), [
+                dict(desc=desc, user_id=current_user.id) for desc in missing
+            ])
+            new = query.filter(Agent.desc.in_(missing)).all()
+            db.session.execute(sqlalchemy.insert(AgentUsage), [
+                dict(agent_id=agent.id, user_id=current_user.id, uses=0) for agent in new
+            ])
+    except sqlalchemy.exc.IntegrityError:
+        # another worker inserted some of them first, or the collation of the
+        # database matches them to existing agents. Resolve them one by one.
+        for desc in missing:
+            agent = _locked_agent(desc)
+            if agent is None:
+                try:
+                    with db.session.begin_nested():
+                        agent = Agent(desc=desc, user_id=current_user.id)
+                        db.session.add(agent)
+                        db.session.flush()
+                        db.session.add(AgentUsage(agent_id=agent.id, user_id=current_user.id, uses=0))
+                except sqlalchemy.exc.IntegrityError:
+                    agent = _locked_agent(desc)
+            agents[desc] = agent
+        return agents
+
+    agents.update({agent.desc: agent for agent in new})
+    return agents
\ No newline at end of file
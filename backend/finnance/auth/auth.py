@@ -2,7 +2,7 @@ import re
 from http import HTTPStatus
 
 from finnance.errors import APIError, validate
-from finnance.models import User
+from finnance.models import Account, User
 from flask import Blueprint, jsonify
 from flask_login import current_user, login_required, login_user, logout_user
 
@@ -128,4 +128,7 @@ def session():
 @auth.route("/me")
 @login_required
 def me():
-    return current_user.api()
+    # the loaders fill the relations of the already loaded current_user
+    user = User.query.options(*User.loaders()).filter_by(id=current_user.id).one()
+    Account.load_saldos(user.accounts)
+    return user.api()
@@ -0,0 +1 @@
+from .cache import LRUCache, bump_version, cached
\ No newline at end of file
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+import sqlalchemy
+from finnance.models import DataVersion
+from flask import current_app, request
+from flask_login import current_user
+
+from finnance import db
+
+# every user has a data version that is bumped by each write, responses
+# cached under an older version are never served again and age out of the
+# LRU. The version lives in the database so all workers see the same one.
+
+def bump_version(user_id: int):
+    updated = db.session.execute(sqlalchemy.update(DataVersion).where(
+        DataVersion.user_id == user_id
+    ).values(version=DataVersion.version + 1)).rowcount
+    if updated == 0:
+        db.session.add(DataVersion(user_id=user_id, version=1))
+    try:
+        db.session.commit()
+    except sqlalchemy.exc.IntegrityError:
+        # another worker created the row first
+        db.session.rollback()
+        bump_version(user_id)
+
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self.entries), maxsize=self.maxsize)
+
+def cached(cache: LRUCache):
+    """caches successful responses of a view per user, data version and query string"""
+    def decorator(foo):
+        @wraps(foo)
+        def wrapper(**kwargs):
+            key = (current_user.id, DataVersion.current(),
+                   request.path, tuple(sorted(request.args.items())))
+            entry = cache.get(key)
+            if entry is None:
+                response = current_app.make_response(foo(**kwargs))
+                if response.status_code != 200:
+                    return response
+                entry = (response.get_data(), response.mimetype)
+                cache.put(key, entry)
+            data, mimetype = entry
+            return current_app.response_class(data, mimetype=mimetype)
+        return wrapper
+    return decorator
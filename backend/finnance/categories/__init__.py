@@ -1 +1 @@
-from .categories import categories
\ No newline at end of file
+from .categories import CategoryNode, categories, category_tree
\ No newline at end of file
@@ -1,55 +1,104 @@
 
 import re
+from collections import defaultdict
+from dataclasses import dataclass
 from http import HTTPStatus
+from types import MappingProxyType
 
+from finnance.cache import LRUCache
+from finnance.closure import attach, is_descendant, move
 from finnance.errors import APIError, validate
-from finnance.models import Category, JSONModel
+from finnance.models import Category, DataVersion, JSONModel
 from flask import Blueprint, jsonify
 from flask_login import current_user, login_required
 
-from finnance import db
+from finnance import app, db
 
 categories = Blueprint('categories', __name__, url_prefix='/api/categories')
 
 @categories.route("/<int:category_id>")
 @login_required
 def category(category_id):
-    cat = Category.query.filter_by(
+    cat = Category.query.options(*Category.loaders()).filter_by(
         user_id=current_user.id, id=category_id).first()
     if cat is None:
         raise APIError(HTTPStatus.NOT_FOUND)
+    Category.load_parents([cat])
     return cat.api()
 
-def with_parent(parent_id: int | None, is_expense: bool):
-    return Category.query.filter_by(
-        user_id=current_user.id, parent_id=parent_id, is_expense=is_expense
-    ).order_by(
-        Category.is_expense, Category.order
-    ).all()
+@dataclass(frozen=True)
+class CategoryNode:
+    id: int
+    desc: str
+    is_expense: bool
+    usable: bool
+    parent_id: int | None
+    color: str
+    order: int
+    # read-only, the nodes are shared by all requests of the user
+    json: MappingProxyType
 
-def hierarchy(category: Category, json=False):
+class CategoryTree:
+    """immutable snapshot of a user's categories, children sorted by order.
+    The reads walk the whole hierarchy anyway, so it is loaded from the
+    category rows in one query; the closure table serves the writes (cycle
+    checks and subtree moves)."""
+    def __init__(self, categories: list[Category]):
+        self.nodes = {
+            cat.id: CategoryNode(
+                id=cat.id, desc=cat.desc, is_expense=cat.is_expense, usable=cat.usable,
+                parent_id=cat.parent_id, color=cat.color, order=cat.order,
+                json=MappingProxyType(cat.json(deep=False))
+            )
+            for cat in categories
+        }
+        children = defaultdict(list)
+        for cat in categories:
+            children[cat.parent_id].append(self.nodes[cat.id])
+        self._children = {parent_id: tuple(nodes) for parent_id, nodes in children.items()}
+
+    def children(self, parent_id: int | None) -> tuple[CategoryNode]:
+        return self._children.get(parent_id, ())
+
+    def roots(self, is_expense: bool) -> list[CategoryNode]:
+        return [node for node in self.children(None) if node.is_expense == is_expense]
+
+tree_cache = LRUCache(app.config['CATEGORY_TREE_CACHE_SIZE'])
+
+def category_tree() -> CategoryTree:
+    """the current user's category tree, rebuilt from one query after writes"""
+    key = (current_user.id, DataVersion.current())
+    tree = tree_cache.get(key)
+    if tree is None:
+        tree = CategoryTree(Category.query.filter_by(
+            user_id=current_user.id).order_by(Category.order).all())
+        tree_cache.put(key, tree)
+    return tree
+
+def hierarchy(tree: CategoryTree, category: CategoryNode, json=False):
     return {
-        'category': category.json(deep=False) if json else category,
+        'category': dict(category.json) if json else category,
         'children': [
-            hierarchy(cat, json=json)
-            for cat in with_parent(category.id, category.is_expense)
+            hierarchy(tree, node, json=json)
+            for node in tree.children(category.id) if node.is_expense == category.is_expense
         ]
     }
 
-def flatten(category, children):
+def flatten(tree: CategoryTree, category: CategoryNode, children):
     return [
         dict(id=category.id, desc=category.desc, usable=category.usable,
-             parent_desc=category.desc if category.parent_id is None else category.parent.desc),
+             parent_desc=category.desc if category.parent_id is None else tree.nodes[category.parent_id].desc),
         *[
-            cat for child in children for cat in flatten(**child)
+            cat for child in children for cat in flatten(tree, **child)
         ]
     ]
 
 def descs(is_expense: bool):
+    tree = category_tree()
     return [
         flat
-        for cat in with_parent(None, is_expense)
-        for flat in flatten(**hierarchy(cat))
+        for node in tree.roots(is_expense)
+        for flat in flatten(tree, **hierarchy(tree, node))
     ]
 
 @categories.route("/expenses")
@@ -65,15 +114,17 @@ def incomes_descs():
 @categories.route("/hierarchy/expenses")
 @login_required
 def expenses_hierarchy():
+    tree = category_tree()
     return JSONModel.obj_to_api([
-        hierarchy(cat, json=True) for cat in with_parent(None, True)
+        hierarchy(tree, node, json=True) for node in tree.roots(True)
     ])
 
 @categories.route("/hierarchy/incomes")
 @login_required
 def incomes_hierarchy():
+    tree = category_tree()
     return JSONModel.obj_to_api([
-        hierarchy(cat, json=True) for cat in with_parent(None, False)
+        hierarchy(tree, node, json=True) for node in tree.roots(False)
     ])
 
 @categories.route("/add", methods=["POST"])
@@ -110,6 +161,8 @@ def add_category(desc: str, is_expense: bool, color: str, usable: bool, parent_i
                         order=order)
         
     db.session.add(category)
+    db.session.flush()
+    attach(category)
     db.session.commit()
     return '', HTTPStatus.CREATED
 
@@ -148,8 +201,12 @@ def edit_category(category_id: int, **data):
         changed = changed or category.parent_id != data['parent_id']
         if data['parent_id'] == category.id: 
             raise APIError(HTTPStatus.BAD_REQUEST, "parent_id must not be its own id")
-        if data['parent_id'] is not None and Category.query.filter_by(user_id=current_user.id, id=data['parent_id']) is None:
+        if data['parent_id'] is not None and Category.query.filter_by(user_id=current_user.id, id=data['parent_id']).first() is None:
             raise APIError(HTTPStatus.BAD_REQUEST, "invalid parent_id")
+        if data['parent_id'] is not None and is_descendant(data['parent_id'], category.id):
+            raise APIError(HTTPStatus.BAD_REQUEST, "parent_id must not be a descendant")
+        if category.parent_id != data['parent_id']:
+            move(category, data['parent_id'])
         category.parent_id = data['parent_id']
 
     if not changed:
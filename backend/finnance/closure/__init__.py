@@ -0,0 +1 @@
+from .closure import attach, closure_cli, is_descendant, move, rebuild
\ No newline at end of file
@@ -0,0 +1,85 @@
+import click
+from finnance.cache import bump_version
+from finnance.models import Category, CategoryClosure, User
+from flask.cli import AppGroup
+
+from finnance import db
+
+closure_cli = AppGroup('closure', help='Maintain the category closure table.')
+
+# one (ancestor, descendant, depth) row for every category and each of its
+# ancestors, including (category, category, 0). Cycle checks and subtree
+# moves are single indexed lookups instead of walks along parent_id.
+
+def attach(category: Category):
+    """adds the rows of a new category below its parent"""
+    db.session.add(CategoryClosure(
+        ancestor_id=category.id, descendant_id=category.id, depth=0))
+    if category.parent_id is not None:
+        db.session.add_all([
+            CategoryClosure(ancestor_id=row.ancestor_id, descendant_id=category.id,
+                            depth=row.depth + 1)
+            for row in CategoryClosure.query.filter_by(descendant_id=category.parent_id)
+        ])
+
+def move(category: Category, parent_id: int | None):
+    """moves the subtree of category below parent_id"""
+    subtree = CategoryClosure.query.filter_by(ancestor_id=category.id).all()
+    ids = [row.descendant_id for row in subtree]
+    CategoryClosure.query.filter(
+        CategoryClosure.descendant_id.in_(ids), CategoryClosure.ancestor_id.not_in(ids)
+    ).delete()
+    if parent_id is not None:
+        db.session.add_all([
+            CategoryClosure(ancestor_id=above.ancestor_id, descendant_id=below.descendant_id,
+                            depth=above.depth + below.depth + 1)
+            for above in CategoryClosure.query.filter_by(descendant_id=parent_id)
+            for below in subtree
+        ])
+
+def is_descendant(category_id: int, ancestor_id: int) -> bool:
+    return db.session.get(CategoryClosure, (ancestor_id, category_id)) is not None
+
+def _closure():
+    parents = {cat.id: cat.parent_id for cat in Category.query}
+    rows = set()
+    for cat_id in parents:
+        ancestor, level, seen = cat_id, 0, set()
+        # stop at cycles, which could be created before edits were checked
+        while ancestor is not None and ancestor not in seen:
+            seen.add(ancestor)
+            rows.add((ancestor, cat_id, level))
+            ancestor, level = parents.get(ancestor), level + 1
+    return rows
+
+def _drift(actual: set):
+    stored = {(row.ancestor_id, row.descendant_id, row.depth) for row in CategoryClosure.query}
+    return len(stored ^ actual)
+
+def rebuild() -> int:
+    """recompute the closure table from the parent ids, returns the number of drifted rows"""
+    actual = _closure()
+    drift = _drift(actual)
+    CategoryClosure.query.delete()
+    db.session.add_all([
+        CategoryClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=level)
+        for ancestor_id, descendant_id, level in actual
+    ])
+    return drift
+
+@closure_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the closure table from the parent ids."""
+    drift = rebuild()
+    db.session.commit()
+    for user in User.query:
+        bump_version(user.id)
+    click.echo(f"closure rebuilt, {drift} drifted rows fixed")
+
+@closure_cli.command('verify')
+def verify_command():
+    """Compare the closure table against the parent ids without writing."""
+    drift = _drift(_closure())
+    click.echo(f"{drift} drifted rows")
+    if drift:
+        raise SystemExit(1)
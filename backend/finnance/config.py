@@ -6,7 +6,9 @@ BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
 # Define the database - we are working with
 if get_debug_flag():
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, 'app.db')
+    # the tests run on their own database
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_URI', 'sqlite:///' + os.path.join(BASE_DIR, 'app.db'))
 else:
     MARIADB_ROOT_PASSWORD=os.environ["MARIADB_ROOT_PASSWORD"]
     MARIADB_DATABASE=os.environ["MARIADB_DATABASE"]
@@ -19,6 +21,28 @@ DATABASE_CONNECT_OPTIONS = {}
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# number of chart responses kept per worker
+CHART_CACHE_SIZE = 256
+# number of category trees kept per worker
+CATEGORY_TREE_CACHE_SIZE = 64
+# 'orjson', 'stdlib' or 'auto' (orjson if it is installed)
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'auto')
+# streamed json arrays are written in chunks of about this many bytes
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
+# transactions loaded per query by /api/export
+EXPORT_BATCH_SIZE = 1000
+# largest batch accepted by /api/transactions/import
+IMPORT_MAX_ROWS = 10000
+# most (account, date) pairs per /api/accounts/saldos request
+SALDO_POINTS_MAX = 500
+# most buckets per account in /api/nivo/saldos, longer ranges are merged
+SALDO_SERIES_MAX_POINTS = 400
+# part of every ETag, set it to the release (e.g. the git commit) so clients
+# refetch responses whose shape changed with a deploy
+APP_VERSION = os.environ.get('APP_VERSION', '')
+# fail GET requests that lazy load a relationship, finds missing eager loads
+RAISE_ON_LAZY_LOAD = os.environ.get('RAISE_ON_LAZY_LOAD') == '1'
+
 # Application threads. A common general assumption is
 # using 2 per available processor cores - to handle
 # incoming requests using one and performing background
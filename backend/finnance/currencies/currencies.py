@@ -2,7 +2,9 @@
 from http import HTTPStatus
 
 from finnance.errors import APIError, validate
-from finnance.models import Currency, JSONModel
+from finnance.ledger import drop
+from finnance.models import Account, Currency, JSONModel, MonthlyTotal, Transaction
+from finnance.usage import agent_uses, update_uses
 from flask import Blueprint, jsonify
 from flask_login import current_user, login_required
 
@@ -19,9 +21,11 @@ def all_currencies():
 @currencies.route("/<int:currency_id>")
 @login_required
 def currency(currency_id):
-    currency = Currency.query.filter_by(user_id=current_user.id, id=currency_id).first()
+    currency = Currency.query.options(*Currency.loaders()).filter_by(
+        user_id=current_user.id, id=currency_id).first()
     if currency is None:
         raise APIError(HTTPStatus.NOT_FOUND)
+    Account.load_saldos(currency.accounts)
     return currency.api()
 
 @currencies.route("/add", methods=["POST"])
@@ -51,7 +55,9 @@ def currency_dependencies(currency_id: int):
     if curr is None:
         raise APIError(HTTPStatus.NOT_FOUND)
 
-    return jsonify(dict(accounts=len(curr.accounts), transactions=len(curr.transactions)))
+    # counted in the database, the collections are not loaded for GET requests
+    return jsonify(dict(accounts=Account.query.filter_by(currency_id=curr.id).count(),
+                        transactions=Transaction.query.filter_by(currency_id=curr.id).count()))
 
 @currencies.route("/<int:currency_id>/delete", methods=["DELETE"])
 @login_required
@@ -60,6 +66,10 @@ def delete_currency(currency_id: int):
     if curr is None:
         raise APIError(HTTPStatus.NOT_FOUND)
     
+    for acc in curr.accounts:
+        drop(acc)
+    MonthlyTotal.query.filter_by(currency_id=curr.id).delete()
+    uses = [u for trans in curr.transactions for u in agent_uses(trans)]
     for trans in curr.transactions:
         for flow in trans.flows:
             db.session.delete(flow)
@@ -75,6 +85,7 @@ def delete_currency(currency_id: int):
         db.session.delete(acc)
     
     db.session.delete(curr)
+    update_uses(removed=uses)
     db.session.commit()
 
     return jsonify({}), HTTPStatus.OK
@@ -0,0 +1 @@
+from .encoding import OrjsonEncoder, StdlibEncoder, make_encoder
\ No newline at end of file
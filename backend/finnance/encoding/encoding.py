@@ -0,0 +1,41 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    # optional, the stdlib encoder produces the same documents
+    orjson = None
+
+# both encoders hand datetimes to the same default function, so dates are
+# formatted identically whichever one is used. Output is utf-8 bytes.
+
+class StdlibEncoder:
+    separator = b", "
+
+    def __init__(self, default):
+        self.default = default
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj, default=self.default).encode()
+
+class OrjsonEncoder:
+    separator = b","
+
+    def __init__(self, default):
+        self.default = default
+        self.option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj, default=self.default, option=self.option)
+
+def make_encoder(name: str, default):
+    """encoder for the JSON_ENCODER setting: 'orjson', 'stdlib' or 'auto'"""
+    if name == 'auto':
+        name = 'stdlib' if orjson is None else 'orjson'
+    if name == 'orjson':
+        if orjson is None:
+            raise RuntimeError("JSON_ENCODER is 'orjson' but orjson is not installed")
+        return OrjsonEncoder(default)
+    if name == 'stdlib':
+        return StdlibEncoder(default)
+    raise ValueError(f"unknown JSON_ENCODER '{name}'")
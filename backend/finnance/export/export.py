@@ -0,0 +1,114 @@
+import csv
+import io
+from datetime import datetime
+from http import HTTPStatus
+
+from finnance.errors import APIError
+from finnance.models import AccountTransfer, Flow, JSONModel, Transaction
+from finnance.params import filterSearchParams, parseSearchParams
+from flask import Blueprint, current_app, request, stream_with_context
+from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload, selectinload
+
+export = Blueprint('export', __name__, url_prefix='/api/export')
+
+# the history is read in batches keyed on the primary key, every batch is
+# one indexed range query plus one IN query per eager loaded collection.
+# Only the current batch is referenced, so memory does not grow with the
+# size of the history.
+
+CSV_COLUMNS = ['type', 'id', 'trans_id', 'date_issued', 'amount', 'is_expense', 'currency_id',
+               'account_id', 'agent', 'category_id', 'is_debt', 'src_id', 'dst_id',
+               'src_amount', 'dst_amount', 'comment']
+
+def batches(query, id_column, size: int):
+    last_id = None
+    while True:
+        batch = query if last_id is None else query.filter(id_column > last_id)
+        batch = batch.order_by(id_column).limit(size).all()
+        yield batch
+        if len(batch) < size:
+            return
+        last_id = batch[-1].id
+
+def history(user_id: int, params: dict):
+    """yields the user's transactions, then the transfers, as json objects"""
+    size = current_app.config['EXPORT_BATCH_SIZE']
+
+    transactions = Transaction.query.filter_by(user_id=user_id).options(
+        joinedload(Transaction.agent), selectinload(Transaction.records),
+        selectinload(Transaction.flows).joinedload(Flow.agent)
+    )
+    transactions = filterSearchParams(transactions, params, Transaction.date_issued, [])
+    for batch in batches(transactions, Transaction.id, size):
+        for trans in batch:
+            yield dict(
+                trans.json(deep=False),
+                agent=trans.agent.desc,
+                records=[rec.json(deep=False) for rec in trans.records],
+                flows=[flow.json(deep=False) for flow in trans.flows],
+            )
+
+    transfers = AccountTransfer.query.filter_by(user_id=user_id)
+    transfers = filterSearchParams(transfers, params, AccountTransfer.date_issued, [])
+    for batch in batches(transfers, AccountTransfer.id, size):
+        for transfer in batch:
+            yield transfer.json(deep=False)
+
+def rows(obj: dict):
+    """flattens an exported object into csv rows, records and flows get their own rows"""
+    date_issued = obj['date_issued'] and JSONModel.default(obj['date_issued'])
+    if obj['type'] == 'accounttransfer':
+        yield dict(obj, type='transfer', date_issued=date_issued)
+        return
+    yield dict(obj, type='transaction', date_issued=date_issued)
+    for rec in obj['records']:
+        yield dict(rec)
+    for flow in obj['flows']:
+        yield dict(flow, agent=flow['agent_desc'])
+
+def ndjson(objs):
+    encoder = JSONModel.encoder
+    for obj in objs:
+        yield encoder.dumps(obj) + b"\n"
+
+def csv_lines(objs):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, CSV_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    for obj in objs:
+        writer.writerows(rows(obj))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+def chunked(parts):
+    chunk_size = current_app.config['JSON_STREAM_CHUNK_SIZE']
+    chunk = bytearray()
+    for part in parts:
+        chunk += part
+        if len(chunk) >= chunk_size:
+            yield bytes(chunk)
+            chunk.clear()
+    yield bytes(chunk)
+
+@export.route("")
+@login_required
+def export_history():
+    kwargs = parseSearchParams(request.args.to_dict(), dict(
+        start=datetime, end=datetime, format=str
+    ))
+    export_format = kwargs.get('format', 'ndjson')
+    if export_format == 'ndjson':
+        encode, mimetype = ndjson, 'application/x-ndjson'
+    elif export_format == 'csv':
+        encode, mimetype = csv_lines, 'text/csv'
+    else:
+        raise APIError(HTTPStatus.BAD_REQUEST, 'format must be ndjson or csv')
+
+    objs = history(current_user.id, kwargs)
+    response = current_app.response_class(
+        stream_with_context(chunked(encode(objs))), mimetype=mimetype)
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename=finnance-export.{export_format}')
+    return response
@@ -1,10 +1,10 @@
 from datetime import datetime
-from math import ceil
 
-from finnance.params import parseSearchParams
-from finnance.models import Flow, Transaction, JSONModel
+from finnance.params import filterSearchParams, paginate, parseSearchParams
+from finnance.models import Agent, Flow, Transaction, JSONModel
 from flask import Blueprint, request
 from flask_login import current_user, login_required
+from sqlalchemy.orm import contains_eager
 
 flows = Blueprint('flows', __name__, url_prefix='/api/flows')
 
@@ -15,27 +15,18 @@ def get_flows():
         start=datetime, end=datetime, search=str
     ))
 
-    result = Flow.query.join(Transaction).filter_by(user_id=current_user.id).order_by(Transaction.date_issued.desc())
-    if 'start' in kwargs:
-        result = result.filter(Transaction.date_issued >= kwargs.get('start'))
-    if 'end' in kwargs:
-        result = result.filter(Transaction.date_issued < kwargs.get('end'))
-    
-    pagesize = kwargs.get('pagesize')
-    page = kwargs.get('page')
+    result = Flow.query.join(Transaction).join(Agent, Agent.id == Flow.agent_id).filter(
+        Transaction.user_id == current_user.id
+    ).options(
+        contains_eager(Flow.trans), contains_eager(Flow.agent)
+    ).order_by(Transaction.date_issued.desc(), Transaction.id.desc(), Flow.id)
+    result = filterSearchParams(result, kwargs, Transaction.date_issued,
+                                [Transaction.comment, Agent.desc])
 
-    # search filter
-    result = list(filter(
-        lambda f: 'search' not in kwargs or any(
-            kwargs['search'].lower() in string for string in [
-                f.trans.comment.lower(),
-                f.agent.desc.lower(),
-        ]),
-        result.all()
-    ))
+    pages, result = paginate(result, kwargs)
     return JSONModel.obj_to_api(dict(
-        pages= ceil(len(result) / pagesize),
+        pages=pages,
         flows=[
         flow.json(deep=True)
-        for flow in result[pagesize*page:pagesize*(page+1)]
+        for flow in result
     ]))
\ No newline at end of file
@@ -0,0 +1 @@
+from .indexes import indexes_cli
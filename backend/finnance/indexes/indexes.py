@@ -0,0 +1,91 @@
+import re
+
+import click
+import sqlalchemy
+from finnance.models import Account, Currency, User
+from flask import g
+from flask.cli import AppGroup
+from flask_login import login_user
+
+from finnance import app, db
+
+indexes_cli = AppGroup('indexes', help='Check the query plans of the hot queries.')
+
+# the listing and chart views are run for a user and every query they send
+# is explained, so the check follows the views instead of copies of their
+# queries. Plans depend on the table statistics, so the check is only
+# meaningful on a database of realistic size.
+
+def plan(sql: str, parameters) -> dict:
+    """index used for each table of sql, None for full table scans"""
+    connection = db.session.connection()
+    if db.engine.dialect.name == 'sqlite':
+        used = {}
+        for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", parameters):
+            match = re.match(r'(?:SEARCH|SCAN) (\w+)(?: USING (?:COVERING )?INDEX (\w+)'
+                             r'| USING (INTEGER PRIMARY KEY))?', row.detail)
+            if match:
+                used[match.group(1)] = match.group(2) or (match.group(3) and 'PRIMARY')
+        return used
+    return {row.table: row.key for row in connection.exec_driver_sql(f"EXPLAIN {sql}", parameters)}
+
+def statements(user: User, url: str) -> list:
+    """(sql, parameters) of the selects sent by the view of url for user"""
+    sent = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            sent.append((statement, parameters))
+
+    with app.test_request_context(url):
+        login_user(user)
+        # a data version no response or tree was cached under, the view runs all its queries
+        g.data_version = object()
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = app.full_dispatch_request()
+            # streamed responses query while they are read
+            response.get_data()
+        finally:
+            sqlalchemy.event.remove(db.engine, 'before_cursor_execute', record)
+    if response.status_code != 200:
+        raise click.ClickException(f"{url} answered {response.status_code}")
+    return sent
+
+def hot_queries(account: Account, currency: Currency):
+    """(url, {table: accepted indexes}) of the listings and charts"""
+    loads = {'record': {'ix_record_trans'}, 'flow': {'ix_flow_trans'}}
+    yield '/api/transactions', {'trans': {'ix_trans_user_date'}, **loads}
+    yield f'/api/transactions?account_id={account.id}', {'trans': {'ix_trans_account_date'}, **loads}
+    yield '/api/records', {'trans': {'ix_trans_user_date'}, 'record': {'ix_record_trans'}}
+    # partial months at both ends, so the records are summed up too
+    yield (f'/api/nivo/categories?currency_id={currency.id}&is_expense=true'
+           f'&min_date=2020-01-15T00:00:00&max_date=2020-12-15T00:00:00'), {
+        'trans': {'ix_trans_currency_date'}, 'record': {'ix_record_trans'}}
+    yield '/api/agents?limit=10', {'agent_usage': {'ix_agent_usage_order'}}
+
+@indexes_cli.command('verify')
+def verify_command():
+    """Explain the queries of the listings and charts and check the indexes they use."""
+    user = User.query.first()
+    account = Account.query.filter_by(user_id=user.id).first() if user else None
+    currency = Currency.query.filter_by(user_id=user.id).first() if user else None
+    if account is None or currency is None:
+        click.echo("no user with an account and a currency to explain the queries for")
+        raise SystemExit(1)
+    misses = 0
+    for url, expected in hot_queries(account, currency):
+        plans = [plan(sql, parameters) for sql, parameters in statements(user, url)]
+        for table, indexes in expected.items():
+            used = [used[table] for used in plans if table in used]
+            if not used:
+                click.echo(f"{url}: {table} is not queried")
+                misses += 1
+            for index in used:
+                if index not in indexes:
+                    click.echo(f"{url}: {table} uses {index or 'no index'}, "
+                               f"expected {' or '.join(sorted(indexes))}")
+                    misses += 1
+    click.echo(f"{misses} queries without their index")
+    if misses:
+        raise SystemExit(1)
@@ -0,0 +1,2 @@
+from .ledger import (drop, ledger_cli, post_transaction, post_transfer, rebuild,
+                     saldos_at, shift, unpost_transaction, unpost_transfer)
\ No newline at end of file
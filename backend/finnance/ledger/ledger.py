@@ -0,0 +1,177 @@
+from datetime import datetime
+
+import click
+import sqlalchemy
+from finnance.cache import bump_version
+from finnance.models import (Account, AccountTransfer, LedgerEntry, Transaction,
+                             User)
+from flask.cli import AppGroup
+
+from finnance import db
+
+ledger_cli = AppGroup('ledger', help='Maintain the per-account balance ledger.')
+
+# every account change is stored as one entry holding its signed amount and
+# the running saldo after it, ordered by LedgerEntry.ordering() like
+# Account.changes(). Writes only touch the entries after the changed one,
+# reading the current saldo is one lookup.
+
+def lock(*account_ids: int):
+    """serializes the ledger writes of the accounts until the transaction ends"""
+    # the saldo before a change is read from the snapshot of the transaction
+    # under InnoDB's REPEATABLE READ, concurrent posts to an account would
+    # miss each other. Rows are locked in id order, so transfers in opposite
+    # directions do not deadlock.
+    Account.query.filter(Account.id.in_(account_ids)).order_by(
+        Account.id).with_for_update().all()
+
+def after(date_issued, kind: int, change_id: int):
+    """entries ordered after the position of a change"""
+    change = LedgerEntry.trans_id if kind == LedgerEntry.TRANSACTION else LedgerEntry.transfer_id
+    return sqlalchemy.or_(
+        LedgerEntry.date_issued > date_issued,
+        sqlalchemy.and_(LedgerEntry.date_issued == date_issued, sqlalchemy.or_(
+            LedgerEntry.kind > kind,
+            sqlalchemy.and_(LedgerEntry.kind == kind, change > change_id)
+        ))
+    )
+
+def post(account_id: int, date_issued, amount: int, kind: int, trans_id=None, transfer_id=None):
+    lock(account_id)
+    position = after(date_issued, kind, trans_id if transfer_id is None else transfer_id)
+    prev = LedgerEntry.query.filter(
+        LedgerEntry.account_id == account_id, ~position
+    ).order_by(*LedgerEntry.ordering(descending=True)).first()
+    if prev is None:
+        saldo = db.session.get(Account, account_id).starting_saldo
+    else:
+        saldo = prev.saldo
+
+    db.session.execute(sqlalchemy.update(LedgerEntry).where(
+        LedgerEntry.account_id == account_id, position
+    ).values(saldo=LedgerEntry.saldo + amount))
+
+    entry = LedgerEntry(account_id=account_id, date_issued=date_issued, kind=kind, amount=amount,
+                        saldo=saldo + amount, trans_id=trans_id, transfer_id=transfer_id)
+    db.session.add(entry)
+    return entry
+
+def unpost(entry: LedgerEntry):
+    lock(entry.account_id)
+    change_id = entry.trans_id if entry.transfer_id is None else entry.transfer_id
+    db.session.execute(sqlalchemy.update(LedgerEntry).where(
+        LedgerEntry.account_id == entry.account_id,
+        after(entry.date_issued, entry.kind, change_id)
+    ).values(saldo=LedgerEntry.saldo - entry.amount))
+    db.session.delete(entry)
+
+def post_transaction(trans: Transaction):
+    if trans.account_id is None:
+        return
+    post(trans.account_id, trans.date_issued, -trans.amount if trans.is_expense else trans.amount,
+         LedgerEntry.TRANSACTION, trans_id=trans.id)
+
+def unpost_transaction(trans: Transaction):
+    for entry in LedgerEntry.query.filter_by(trans_id=trans.id).all():
+        unpost(entry)
+
+def post_transfer(transfer: AccountTransfer):
+    lock(transfer.src_id, transfer.dst_id)
+    post(transfer.src_id, transfer.date_issued, -transfer.src_amount,
+         LedgerEntry.OUTGOING, transfer_id=transfer.id)
+    post(transfer.dst_id, transfer.date_issued, transfer.dst_amount,
+         LedgerEntry.INCOMING, transfer_id=transfer.id)
+
+def unpost_transfer(transfer: AccountTransfer):
+    lock(transfer.src_id, transfer.dst_id)
+    for entry in LedgerEntry.query.filter_by(transfer_id=transfer.id).all():
+        unpost(entry)
+
+def shift(account: Account, amount: int):
+    lock(account.id)
+    db.session.execute(sqlalchemy.update(LedgerEntry).where(
+        LedgerEntry.account_id == account.id
+    ).values(saldo=LedgerEntry.saldo + amount))
+
+def drop(account: Account):
+    # transfers also move the saldo of the other account
+    for transfer in set(account.in_transfers + account.out_transfers):
+        unpost_transfer(transfer)
+    LedgerEntry.query.filter_by(account_id=account.id).delete()
+
+def saldos_at(points: list[tuple[Account, datetime]], inclusive=True) -> list[int]:
+    """saldo of each account after its changes issued up to the date (or only before
+    it), all points are read in one query with one index lookup each"""
+    if not points:
+        return []
+    row = db.session.execute(sqlalchemy.select(*[
+        sqlalchemy.select(LedgerEntry.saldo).where(
+            LedgerEntry.account_id == account.id,
+            LedgerEntry.date_issued <= date if inclusive else LedgerEntry.date_issued < date
+        ).order_by(*LedgerEntry.ordering(descending=True)).limit(1).scalar_subquery()
+        for account, date in points
+    ])).one()
+    return [
+        account.starting_saldo if saldo is None else saldo
+        for (account, _), saldo in zip(points, row)
+    ]
+
+def rebuild(account: Account, dry_run=False) -> int:
+    """recompute the ledger of account from scratch, returns the number of drifted entries"""
+    stored = {
+        (entry.trans_id, entry.transfer_id): (entry.kind, entry.saldo)
+        for entry in LedgerEntry.query.filter_by(account_id=account.id)
+    }
+    changes, saldos = account.changes()
+
+    entries = []
+    for change, saldo in zip(changes[::-1], saldos[::-1][1:]):
+        if type(change) is AccountTransfer:
+            amount = -change.src_amount if change.src_id == account.id else change.dst_amount
+            entry = LedgerEntry(transfer_id=change.id)
+        else:
+            amount = -change.amount if change.is_expense else change.amount
+            entry = LedgerEntry(trans_id=change.id)
+        entry.account_id = account.id
+        entry.date_issued = change.date_issued
+        entry.kind = LedgerEntry.kind_of(change, account.id)
+        entry.amount = amount
+        entry.saldo = saldo
+        entries.append(entry)
+
+    drift = sum(
+        stored.pop((entry.trans_id, entry.transfer_id), None) != (entry.kind, entry.saldo)
+        for entry in entries
+    ) + len(stored)
+
+    if not dry_run:
+        LedgerEntry.query.filter_by(account_id=account.id).delete()
+        db.session.add_all(entries)
+    return drift
+
+def _rebuild_all(dry_run: bool) -> int:
+    total = 0
+    for account in Account.query.order_by(Account.id):
+        drift = rebuild(account, dry_run=dry_run)
+        if drift:
+            click.echo(f"account {account.id} ({account.desc}): {drift} drifted entries")
+        total += drift
+    return total
+
+@ledger_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the ledger of every account and report drift."""
+    total = _rebuild_all(dry_run=False)
+    db.session.commit()
+    # cached responses contain the old saldos
+    for user in User.query:
+        bump_version(user.id)
+    click.echo(f"ledger rebuilt, {total} drifted entries fixed")
+
+@ledger_cli.command('verify')
+def verify_command():
+    """Compare the ledger against the account histories without writing."""
+    total = _rebuild_all(dry_run=True)
+    click.echo(f"{total} drifted entries")
+    if total:
+        raise SystemExit(1)
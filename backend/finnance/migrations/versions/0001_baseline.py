@@ -0,0 +1,256 @@
+"""baseline, the schema as created by db.create_all() before migrations
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # databases from before the migrations were created by db.create_all()
+    # at startup, possibly of an older version, only missing tables are added
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    def create_table(name, *elements, indexes=()):
+        if name in existing:
+            return
+        op.create_table(name, *elements)
+        for index, columns in indexes:
+            op.create_index(index, name, columns)
+
+    create_table('user',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=32), nullable=False),
+    sa.Column('email', sa.String(length=64), nullable=False),
+    sa.Column('password', sa.String(length=128), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+    create_table('agent',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('desc', sa.String(length=64), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('desc', 'user_id')
+    )
+    create_table('category',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('desc', sa.String(length=64), nullable=False),
+    sa.Column('is_expense', sa.Boolean(), nullable=False),
+    sa.Column('usable', sa.Boolean(), nullable=False),
+    sa.Column('parent_id', sa.Integer(), nullable=True),
+    sa.Column('color', sa.String(length=7), nullable=False),
+    sa.Column('order', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['parent_id'], ['category.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'desc', 'is_expense'),
+    sa.UniqueConstraint('user_id', 'order', 'is_expense')
+    )
+    create_table('currency',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('code', sa.String(length=3), nullable=False),
+    sa.Column('decimals', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('code', 'user_id')
+    )
+    create_table('data_version',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    create_table('account',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('desc', sa.String(length=32), nullable=False),
+    sa.Column('starting_saldo', sa.Integer(), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=False),
+    sa.Column('currency_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('color', sa.String(length=7), nullable=False),
+    sa.Column('order', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['currency_id'], ['currency.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('desc', 'user_id'),
+    sa.UniqueConstraint('order', 'user_id')
+    )
+    create_table('agent_usage',
+    sa.Column('agent_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('uses', sa.Integer(), nullable=False),
+    sa.Column('last_used', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['agent_id'], ['agent.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('agent_id'),
+    indexes=[('ix_agent_usage_rank', ['user_id', 'uses'])]
+    )
+    create_table('category_closure',
+    sa.Column('ancestor_id', sa.Integer(), nullable=False),
+    sa.Column('descendant_id', sa.Integer(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['category.id'], ),
+    sa.ForeignKeyConstraint(['descendant_id'], ['category.id'], ),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id'),
+    indexes=[('ix_category_closure_descendant', ['descendant_id', 'depth'])]
+    )
+    create_table('monthly_total',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('currency_id', sa.Integer(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.DateTime(), nullable=False),
+    sa.Column('is_expense', sa.Boolean(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['category.id'], ),
+    sa.ForeignKeyConstraint(['currency_id'], ['currency.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'currency_id', 'month', 'category_id', 'is_expense')
+    )
+    create_table('account_transfer',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('src_amount', sa.Integer(), nullable=False),
+    sa.Column('dst_amount', sa.Integer(), nullable=False),
+    sa.Column('src_id', sa.Integer(), nullable=False),
+    sa.Column('dst_id', sa.Integer(), nullable=False),
+    sa.Column('date_issued', sa.DateTime(), nullable=True),
+    sa.Column('comment', sa.String(length=120), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.CheckConstraint('src_id != dst_id'),
+    sa.ForeignKeyConstraint(['dst_id'], ['account.id'], ),
+    sa.ForeignKeyConstraint(['src_id'], ['account.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    create_table('template',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('desc', sa.String(length=64), nullable=False),
+    sa.Column('order', sa.Integer(), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=True),
+    sa.Column('currency_id', sa.Integer(), nullable=True),
+    sa.Column('amount', sa.Integer(), nullable=True),
+    sa.Column('is_expense', sa.Boolean(), nullable=False),
+    sa.Column('agent_id', sa.Integer(), nullable=True),
+    sa.Column('comment', sa.String(length=120), nullable=False),
+    sa.Column('direct', sa.Boolean(), nullable=False),
+    sa.Column('remote_agent_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['account_id'], ['account.id'], ),
+    sa.ForeignKeyConstraint(['agent_id'], ['agent.id'], ),
+    sa.ForeignKeyConstraint(['currency_id'], ['currency.id'], ),
+    sa.ForeignKeyConstraint(['remote_agent_id'], ['agent.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('order', 'user_id')
+    )
+    create_table('trans',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('is_expense', sa.Boolean(), nullable=False),
+    sa.Column('currency_id', sa.Integer(), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=True),
+    sa.Column('agent_id', sa.Integer(), nullable=False),
+    sa.Column('date_issued', sa.DateTime(), nullable=False),
+    sa.Column('comment', sa.String(length=120), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['account_id'], ['account.id'], ),
+    sa.ForeignKeyConstraint(['agent_id'], ['agent.id'], ),
+    sa.ForeignKeyConstraint(['currency_id'], ['currency.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    create_table('flow',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('is_debt', sa.Boolean(), nullable=False),
+    sa.Column('agent_id', sa.Integer(), nullable=False),
+    sa.Column('trans_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['agent_id'], ['agent.id'], ),
+    sa.ForeignKeyConstraint(['trans_id'], ['trans.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('agent_id', 'trans_id')
+    )
+    create_table('flow_template',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('template_id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=True),
+    sa.Column('agent_id', sa.Integer(), nullable=True),
+    sa.Column('ix', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['agent_id'], ['agent.id'], ),
+    sa.ForeignKeyConstraint(['template_id'], ['template.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    create_table('ledger',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('trans_id', sa.Integer(), nullable=True),
+    sa.Column('transfer_id', sa.Integer(), nullable=True),
+    sa.Column('date_issued', sa.DateTime(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('saldo', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['account_id'], ['account.id'], ),
+    sa.ForeignKeyConstraint(['trans_id'], ['trans.id'], ),
+    sa.ForeignKeyConstraint(['transfer_id'], ['account_transfer.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    indexes=[('ix_ledger_account_date', ['account_id', 'date_issued', 'id'])]
+    )
+    create_table('record',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('trans_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['category.id'], ),
+    sa.ForeignKeyConstraint(['trans_id'], ['trans.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('category_id', 'trans_id')
+    )
+    create_table('record_template',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('template_id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=True),
+    sa.Column('category_id', sa.Integer(), nullable=True),
+    sa.Column('ix', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['category.id'], ),
+    sa.ForeignKeyConstraint(['template_id'], ['template.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('record_template')
+    op.drop_table('record')
+    op.drop_index('ix_ledger_account_date', table_name='ledger')
+    op.drop_table('ledger')
+    op.drop_table('flow_template')
+    op.drop_table('flow')
+    op.drop_table('trans')
+    op.drop_table('template')
+    op.drop_table('account_transfer')
+    op.drop_table('monthly_total')
+    op.drop_index('ix_category_closure_descendant', table_name='category_closure')
+    op.drop_table('category_closure')
+    op.drop_index('ix_agent_usage_rank', table_name='agent_usage')
+    op.drop_table('agent_usage')
+    op.drop_table('account')
+    op.drop_table('data_version')
+    op.drop_table('currency')
+    op.drop_table('category')
+    op.drop_table('agent')
+    op.drop_table('user')
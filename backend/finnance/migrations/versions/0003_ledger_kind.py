@@ -0,0 +1,45 @@
+"""order same-date ledger entries by kind like Account.changes()
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ledger', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('kind', sa.Integer(), nullable=False, server_default='0'))
+
+    # 0 transaction, 1 outgoing transfer, 2 incoming transfer
+    ledger = sa.table('ledger', sa.column('account_id'), sa.column('transfer_id'), sa.column('kind'))
+    transfer = sa.table('account_transfer', sa.column('id'), sa.column('src_id'))
+    src_id = sa.select(transfer.c.src_id).where(
+        transfer.c.id == ledger.c.transfer_id).scalar_subquery()
+    op.execute(ledger.update().where(ledger.c.transfer_id.is_not(None)).values(
+        kind=sa.case((ledger.c.account_id == src_id, 1), else_=2)))
+
+    with op.batch_alter_table('ledger', schema=None) as batch_op:
+        batch_op.alter_column('kind', existing_type=sa.Integer(), existing_nullable=False,
+                              server_default=None)
+        batch_op.create_index('ix_ledger_account_order',
+                              ['account_id', 'date_issued', 'kind', 'trans_id', 'transfer_id'],
+                              unique=False)
+        batch_op.drop_index('ix_ledger_account_date')
+
+
+def downgrade():
+    with op.batch_alter_table('ledger', schema=None) as batch_op:
+        batch_op.create_index('ix_ledger_account_date', ['account_id', 'date_issued', 'id'],
+                              unique=False)
+        batch_op.drop_index('ix_ledger_account_order')
+        batch_op.drop_column('kind')
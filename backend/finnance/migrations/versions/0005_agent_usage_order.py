@@ -0,0 +1,29 @@
+"""order the agent ranking by id in its index
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the new index is created first, InnoDB needs one on user_id for its foreign key
+    with op.batch_alter_table('agent_usage', schema=None) as batch_op:
+        batch_op.create_index('ix_agent_usage_order', ['user_id', 'uses', 'agent_id'], unique=False)
+        batch_op.drop_index('ix_agent_usage_rank')
+
+
+def downgrade():
+    with op.batch_alter_table('agent_usage', schema=None) as batch_op:
+        batch_op.create_index('ix_agent_usage_rank', ['user_id', 'uses'], unique=False)
+        batch_op.drop_index('ix_agent_usage_order')
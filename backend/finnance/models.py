@@ -1,18 +1,22 @@
-import json
+from hashlib import sha1
 from math import ceil
-from flask import current_app
+from flask import current_app, g, request, stream_with_context
 import sqlalchemy
 from sqlalchemy.sql.schema import CheckConstraint, UniqueConstraint
-from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy import func
-from finnance import db, login_manager
-from flask_login import UserMixin
+from finnance import app, db, login_manager
+from finnance.encoding import make_encoder
+from flask_login import UserMixin, current_user
 import datetime as dt
 
 
 class JSONModel:
     json_relations = []
     json_ignore = []
+    # relations read by properties, loaded whenever the model is serialized
+    json_property_relations = []
+    # per class serializers, compiled on first use
+    serializers = {}
 
     @staticmethod
     def default(obj):
@@ -26,10 +30,49 @@ class JSONModel:
 
     @staticmethod
     def obj_to_api(obj):
-        return current_app.response_class(
-            f"{json.dumps(obj, default=JSONModel.default)}\n",
+        response = current_app.response_class(
+            JSONModel.encoder.dumps(obj) + b"\n",
             mimetype=current_app.json.mimetype,
         )
+        if current_user.is_authenticated:
+            response.set_etag(JSONModel.etag())
+        return response
+
+    @staticmethod
+    def stream_api(query, serialize):
+        """like obj_to_api for a json array, but runs query and encodes its rows while the
+        response is sent. The session of the view is closed by then, so query must not
+        be executed before."""
+        encoder = JSONModel.encoder
+        chunk_size = current_app.config['JSON_STREAM_CHUNK_SIZE']
+
+        def generate():
+            chunk = bytearray(b"[")
+            for i, row in enumerate(query):
+                if i:
+                    chunk += encoder.separator
+                chunk += encoder.dumps(serialize(row))
+                if len(chunk) >= chunk_size:
+                    yield bytes(chunk)
+                    chunk.clear()
+            chunk += b"]\n"
+            yield bytes(chunk)
+
+        response = current_app.response_class(
+            stream_with_context(generate()),
+            mimetype=current_app.json.mimetype,
+        )
+        if current_user.is_authenticated:
+            response.set_etag(JSONModel.etag())
+        return response
+
+    @staticmethod
+    def etag():
+        """tag of the current request's response, changes with every write of the user
+        and with every release or schema revision"""
+        key = (f"{current_app.config['APP_VERSION']}:{current_app.config['SCHEMA_REVISION']}:"
+               f"{current_user.id}:{DataVersion.current()}:{request.full_path}")
+        return sha1(key.encode()).hexdigest()
 
     @staticmethod
     def jsonValue(obj):
@@ -40,26 +83,52 @@ class JSONModel:
             return [item.json(deep=False) for item in obj]
         return obj
 
+    @staticmethod
+    def compile(cls):
+        """serializer of cls with the column, property and relation names resolved once"""
+        columns = tuple(
+            attr.key for attr in sqlalchemy.inspect(cls).column_attrs
+            if not (attr.key.startswith('_') or attr.key in cls.json_ignore)
+        )
+        properties = tuple(
+            key for key, value in vars(cls).items() if isinstance(value, property)
+        )
+        relations = tuple(cls.json_relations)
+        name = cls.__name__.lower()
+        jsonValue = JSONModel.jsonValue
+
+        def serialize(obj, deep: bool):
+            d = {key: getattr(obj, key) for key in columns}
+            for key in properties:
+                d[key] = jsonValue(getattr(obj, key))
+            d["type"] = name
+            if deep:
+                for key in relations:
+                    d[key] = jsonValue(getattr(obj, key))
+            return d
+        return serialize
+
+    @classmethod
+    def loaders(cls, deep=True):
+        """loader options for everything json(deep) reads: collections are
+        selectin loaded, single objects joined"""
+        options = []
+        for key in (cls.json_relations if deep else []) + cls.json_property_relations:
+            attr = getattr(cls, key)
+            relation = attr.property
+            loader = (sqlalchemy.orm.selectinload if relation.uselist
+                      else sqlalchemy.orm.joinedload)(attr)
+            nested = relation.mapper.class_.loaders(deep=False)
+            options.append(loader.options(*nested) if nested else loader)
+        return options
+
     def json(self, deep: bool):
-        d = {
-            key: self.jsonValue(value)
-            for key, value in self.__dict__.items()
-            if not (key.startswith('_') or key in self.json_ignore
-                    or isinstance(value, db.Model) or isinstance(value, sqlalchemy.orm.collections.InstrumentedList))
-        }
-        # properties
-        d.update({
-            key: self.jsonValue(getattr(self, key))
-            for key in vars(type(self))
-            if isinstance(getattr(type(self), key), property)
-        })
-        d["type"] = type(self).__name__.lower()
-        if deep:
-            d.update({
-                key: self.jsonValue(getattr(self, key))
-                for key in self.json_relations
-            })
-        return d
+        serialize = JSONModel.serializers.get(type(self))
+        if serialize is None:
+            serialize = JSONModel.serializers[type(self)] = JSONModel.compile(type(self))
+        return serialize(self, deep)
+
+JSONModel.encoder = make_encoder(app.config['JSON_ENCODER'], JSONModel.default)
 
 
 class User(db.Model, JSONModel, UserMixin):
@@ -80,6 +149,23 @@ class User(db.Model, JSONModel, UserMixin):
     json_ignore = ["password"]
 
 
+class DataVersion(db.Model, JSONModel):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+    @staticmethod
+    def of(user_id: int) -> int:
+        row = db.session.get(DataVersion, user_id)
+        return 0 if row is None else row.version
+
+    @staticmethod
+    def current() -> int:
+        """version of the logged in user, read once per request"""
+        if 'data_version' not in g:
+            g.data_version = DataVersion.of(current_user.id)
+        return g.data_version
+
+
 class Account(db.Model, JSONModel):
     id = db.Column(db.Integer, primary_key=True)
 
@@ -104,9 +190,11 @@ class Account(db.Model, JSONModel):
 
     def changes(self, num=None):
         saldos = [self.starting_saldo]
+        # the order of the ledger: same-date transactions, outgoing and
+        # incoming transfers, each by id
         changes = sorted(
             self.transactions + self.out_transfers + self.in_transfers,
-            key=lambda ch: ch.date_issued
+            key=lambda ch: (ch.date_issued, LedgerEntry.kind_of(ch, self.id), ch.id)
         )
         for change in changes:
             if type(change) is AccountTransfer:
@@ -121,61 +209,84 @@ class Account(db.Model, JSONModel):
         return changes[::-1] if num is None else changes[-num:][::-1], saldos[::-1]
 
     def jsonify_changes(self, pagesize, page, start=None, end=None, search: str = None):
-        saldo = self.starting_saldo
-        changes = sorted(
-            self.transactions + self.out_transfers + self.in_transfers,
-            key=lambda ch: ch.date_issued
-        )
-        filtered = []
-
-        for i, change in enumerate(changes):
-            if type(change) is AccountTransfer:
-                exp = change.src_id == self.id
-                amount = change.src_amount if exp else change.dst_amount
-            else:
-                exp = change.is_expense
-                amount = change.amount
-
-            saldo = saldo + (amount if not exp else -amount)
-
-            if (start is not None and start > change.date_issued):
-                continue
-            if (end is not None and change.date_issued >= end):
-                continue
-
-            if type(change) is Transaction:
-                desc = change.agent.desc
-            elif change.src_id == self.id:
-                desc = change.dst.desc
-            else:
-                desc = change.src.desc
-
-            if (search is not None):
-                inComment = search.lower() in change.comment.lower()
-                inAgent = search.lower() in desc.lower()
-                if not inComment and not inAgent:
-                    continue
-
-            filtered.append((saldo, desc, change))
+        other = sqlalchemy.orm.aliased(Account)
+        # the ledger holds the saldo after every change in the order of
+        # Account.changes, a page is one range of its index
+        target = sqlalchemy.case(
+            (LedgerEntry.kind == LedgerEntry.TRANSACTION, Agent.desc), else_=other.desc)
+        query = sqlalchemy.select(
+            LedgerEntry.trans_id, LedgerEntry.transfer_id, LedgerEntry.saldo, target.label('target')
+        ).outerjoin(Transaction, Transaction.id == LedgerEntry.trans_id
+        ).outerjoin(Agent, Agent.id == Transaction.agent_id
+        ).outerjoin(AccountTransfer, AccountTransfer.id == LedgerEntry.transfer_id
+        ).outerjoin(other, other.id == sqlalchemy.case(
+            (LedgerEntry.kind == LedgerEntry.OUTGOING, AccountTransfer.dst_id),
+            else_=AccountTransfer.src_id)
+        ).where(LedgerEntry.account_id == self.id)
+        if start is not None:
+            query = query.where(LedgerEntry.date_issued >= start)
+        if end is not None:
+            query = query.where(LedgerEntry.date_issued < end)
+        if search is not None:
+            query = query.where(sqlalchemy.or_(
+                func.coalesce(Transaction.comment, AccountTransfer.comment).icontains(
+                    search, autoescape=True),
+                target.icontains(search, autoescape=True),
+            ))
+
+        total = db.session.scalar(
+            sqlalchemy.select(func.count()).select_from(query.subquery()))
+        rows = db.session.execute(query.order_by(
+            *LedgerEntry.ordering(descending=True)
+        ).limit(pagesize).offset(pagesize*page)).all()
+
+        trans = Transaction.query.filter(
+            Transaction.id.in_([row.trans_id for row in rows if row.trans_id is not None]))
+        transfers = AccountTransfer.query.filter(
+            AccountTransfer.id.in_([row.transfer_id for row in rows if row.transfer_id is not None]))
+        changes = {
+            **{(t.id, None): t for t in trans},
+            **{(None, tf.id): tf for tf in transfers},
+        }
 
         out = [{
             "type": "account_change",
             "acc_id": self.id,
-            "saldo": saldo,
-            "target": desc,
-            "data": change.json(deep=False)
+            "saldo": row.saldo,
+            "target": row.target,
+            "data": changes[(row.trans_id, row.transfer_id)].json(deep=False)
         }
-            for (saldo, desc, change) in filtered[::-1][pagesize*page:pagesize*(page+1)]
+            for row in rows
         ]
 
         return JSONModel.obj_to_api({
-            "pages": ceil(len(filtered) / pagesize),
+            "pages": ceil(total / pagesize),
             "changes": out
         })
 
     @property
     def saldo(self):
-        return self.changes(num=1)[1][0]
+        if '_saldo' in self.__dict__:
+            return self._saldo
+        entry = LedgerEntry.query.filter_by(account_id=self.id).order_by(
+            *LedgerEntry.ordering(descending=True)).first()
+        return self.starting_saldo if entry is None else entry.saldo
+
+    @staticmethod
+    def load_saldos(accounts):
+        """reads the saldos of all accounts in one query, saldo then returns them
+        without querying. Only for reads, later writes don't update them."""
+        accounts = {acc.id: acc for acc in accounts}
+        if not accounts:
+            return
+        latest = sqlalchemy.select(LedgerEntry.saldo).where(
+            LedgerEntry.account_id == Account.id
+        ).order_by(*LedgerEntry.ordering(descending=True)).limit(1)
+        rows = db.session.execute(sqlalchemy.select(
+            Account.id, func.coalesce(latest.scalar_subquery(), Account.starting_saldo)
+        ).where(Account.id.in_(accounts)))
+        for account_id, saldo in rows:
+            accounts[account_id]._saldo = saldo
 
     def starting(self):
         return self.currency.format(self.starting_saldo)
@@ -200,6 +311,15 @@ class Transaction(db.Model, JSONModel):
     agent = db.relationship("Agent", backref="transactions")
     currency = db.relationship("Currency", backref="transactions")
 
+    # listings page by (date_issued, id) per user or account, charts read
+    # date ranges per currency. The views also filter by user, with user_id
+    # in the index the planner prefers it over ix_trans_user_date.
+    __table_args__ = (
+        db.Index('ix_trans_user_date', 'user_id', 'date_issued', 'id'),
+        db.Index('ix_trans_account_date', 'account_id', 'user_id', 'date_issued', 'id'),
+        db.Index('ix_trans_currency_date', 'currency_id', 'user_id', 'date_issued'),
+    )
+
     json_relations = ["account",
                       "agent", "currency", "records", "flows"]
 
@@ -211,11 +331,13 @@ class Record(db.Model, JSONModel):
         'category.id'), nullable=False)
     trans_id = db.Column(db.Integer, db.ForeignKey('trans.id'), nullable=False)
 
-    trans = db.relationship('Transaction', backref='records')
+    # explicit order, ix_record_trans would return them by category
+    trans = db.relationship('Transaction', backref=db.backref('records', order_by='Record.id'))
     category = db.relationship('Category', backref='records')
 
     __table_args__ = (
         UniqueConstraint('category_id', 'trans_id'),
+        db.Index('ix_record_trans', 'trans_id', 'category_id'),
     )
 
     json_relations = ["trans", "category"]
@@ -229,14 +351,17 @@ class Flow(db.Model, JSONModel):
     trans_id = db.Column(db.Integer, db.ForeignKey('trans.id'), nullable=False)
 
     agent = db.relationship('Agent', backref='flows')
-    trans = db.relationship('Transaction', backref='flows')
+    trans = db.relationship('Transaction', backref=db.backref('flows', order_by='Flow.id'))
 
     @property
     def agent_desc(self):
         return self.agent.desc
 
+    json_property_relations = ["agent"]
+
     __table_args__ = (
         UniqueConstraint('agent_id', 'trans_id'),
+        db.Index('ix_flow_trans', 'trans_id'),
     )
 
     json_relations = ["trans", "agent"]
@@ -265,6 +390,60 @@ class AccountTransfer(db.Model, JSONModel):
     json_relations = ["src", "dst"]
 
 
+class LedgerEntry(db.Model, JSONModel):
+    __tablename__ = 'ledger'
+
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    trans_id = db.Column(db.Integer, db.ForeignKey('trans.id'))
+    transfer_id = db.Column(db.Integer, db.ForeignKey('account_transfer.id'))
+    date_issued = db.Column(db.DateTime, nullable=False)
+    # TRANSACTION, OUTGOING or INCOMING, orders the changes of one date
+    kind = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    saldo = db.Column(db.Integer, nullable=False)
+
+    account = db.relationship("Account")
+    trans = db.relationship("Transaction")
+    transfer = db.relationship("AccountTransfer")
+
+    __table_args__ = (
+        db.Index('ix_ledger_account_order', 'account_id', 'date_issued', 'kind',
+                 'trans_id', 'transfer_id'),
+    )
+
+    TRANSACTION, OUTGOING, INCOMING = 0, 1, 2
+
+    @staticmethod
+    def kind_of(change, account_id: int) -> int:
+        if type(change) is not AccountTransfer:
+            return LedgerEntry.TRANSACTION
+        return LedgerEntry.OUTGOING if change.src_id == account_id else LedgerEntry.INCOMING
+
+    @staticmethod
+    def ordering(descending=False):
+        """entries by date, kind and the id of their change. Within a kind only one
+        of trans_id and transfer_id is set."""
+        columns = [LedgerEntry.date_issued, LedgerEntry.kind,
+                   LedgerEntry.trans_id, LedgerEntry.transfer_id]
+        return [column.desc() for column in columns] if descending else columns
+
+
+class MonthlyTotal(db.Model, JSONModel):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    currency_id = db.Column(db.Integer, db.ForeignKey('currency.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    month = db.Column(db.DateTime, nullable=False)
+    is_expense = db.Column(db.Boolean, nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'currency_id', 'month', 'category_id', 'is_expense'),
+    )
+
+
 class Currency(db.Model, JSONModel):
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(3), nullable=False)
@@ -294,13 +473,22 @@ class Agent(db.Model, JSONModel):
 
     json_relations = ["transactions", "flows"]
 
-    @hybrid_property
-    def uses(self):
-        return len(self.transactions) + len(self.flows)
 
-    @uses.expression
-    def uses(cls):
-        return func.count(Transaction.id) + func.count(Flow.id)
+class AgentUsage(db.Model, JSONModel):
+    __tablename__ = 'agent_usage'
+
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # transactions plus flows of the agent
+    uses = db.Column(db.Integer, nullable=False)
+    last_used = db.Column(db.DateTime)
+
+    agent = db.relationship("Agent")
+
+    # the agent listing reads the ranking in index order
+    __table_args__ = (
+        db.Index('ix_agent_usage_order', 'user_id', 'uses', 'agent_id'),
+    )
 
 
 class Category(db.Model, JSONModel):
@@ -318,7 +506,29 @@ class Category(db.Model, JSONModel):
 
     @property
     def parent(self):
-        return Category.query.filter_by(id=self.parent_id, user_id=self.user_id).first()
+        if self.parent_id is None:
+            return None
+        if '_parent' in self.__dict__:
+            return self._parent
+        # identity map lookup, only queries if the parent is not loaded yet
+        parent = db.session.get(Category, self.parent_id)
+        return parent if parent is not None and parent.user_id == self.user_id else None
+
+    @staticmethod
+    def load_parents(categories):
+        """reads the ancestors of all categories in one closure query, parent then
+        returns them without querying"""
+        loaded = {cat.id: cat for cat in categories}
+        if not loaded:
+            return
+        loaded.update({cat.id: cat for cat in Category.query.join(
+            CategoryClosure, CategoryClosure.ancestor_id == Category.id
+        ).filter(CategoryClosure.descendant_id.in_(loaded), CategoryClosure.depth > 0)})
+        for cat in loaded.values():
+            # parents missing from the closure are still looked up by parent
+            if cat.parent_id in loaded:
+                parent = loaded[cat.parent_id]
+                cat._parent = parent if parent.user_id == cat.user_id else None
 
     __table_args__ = (
         UniqueConstraint('user_id', 'desc', 'is_expense'),
@@ -327,6 +537,17 @@ class Category(db.Model, JSONModel):
 
     json_relations = ["records"]
 
+class CategoryClosure(db.Model, JSONModel):
+    __tablename__ = 'category_closure'
+
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('category.id'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('category.id'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_category_closure_descendant', 'descendant_id', 'depth'),
+    )
+
 class TransactionTemplate(db.Model, JSONModel):
     __tablename__ = 'template'
     id = db.Column(db.Integer, primary_key=True)
@@ -369,6 +590,8 @@ class FlowTemplate(db.Model, JSONModel):
     def agent_desc(self):
         return self.agent.desc if self.agent is not None else None
 
+    json_property_relations = ["agent"]
+
     agent = db.relationship("Agent")
     template = db.relationship("TransactionTemplate", backref="flows")
 
@@ -1,17 +1,33 @@
 
 from calendar import monthrange
+from collections import defaultdict
 from datetime import datetime, timedelta
 from functools import wraps
 from http import HTTPStatus
 
+import numpy as np
 import sqlalchemy
+from finnance.cache import LRUCache, cached
+from finnance.categories import CategoryNode, category_tree
 from finnance.errors import APIError
-from finnance.models import Agent, Category, Currency, Record, Transaction
+from finnance.ledger import saldos_at
+from finnance.models import (Account, Agent, Currency, LedgerEntry, MonthlyTotal,
+                             Record, Transaction)
 from flask import Blueprint, jsonify, request
 from flask_login import current_user, login_required
 
+from finnance import app, db
+
 nivo = Blueprint('nivo', __name__, url_prefix='/api/nivo')
 
+# chart responses only depend on the request and the user's data version
+chart_cache = LRUCache(app.config['CHART_CACHE_SIZE'])
+
+@nivo.route("/cache")
+@login_required
+def cache_stats():
+    return jsonify(chart_cache.stats())
+
 def nivo_wrapper(foo):
     @wraps(foo)
     def wrapper(**kwargs):
@@ -53,73 +69,143 @@ def is_expense_wrapper(foo):
         return foo(**kwargs, is_expense=is_expense)
     return wrapper
 
+def end_of_month(dt: datetime):
+    return datetime(dt.year, dt.month, monthrange(dt.year, dt.month)[1], 23, 59, 59) + timedelta(seconds=1)
+
+def start_of_month(dt: datetime):
+    return datetime(dt.year, dt.month, 1)
+
+def months(min_date: datetime, max_date: datetime):
+    """month buckets as (start, end) pairs, the first one always ends at the end of its month"""
+    start = min_date
+    end = end_of_month(start)
+    buckets = []
+    while start < max_date:
+        buckets.append((start, end))
+        start = end
+        end = end_of_month(start)
+        if end > max_date:
+            end = max_date
+    return buckets
+
+# whole months are read from the monthly totals, only the partial months at
+# the edges of a date range are summed up from the records
+
+def record_totals(currency: Currency, ranges: list[tuple[datetime, datetime]], *columns):
+    return Record.query.join(Transaction).filter(
+        Transaction.user_id == current_user.id,
+        Transaction.currency_id == currency.id,
+        sqlalchemy.or_(*[
+            sqlalchemy.and_(Transaction.date_issued >= start, Transaction.date_issued < end)
+            for start, end in ranges
+        ])
+    ).group_by(*columns).with_entities(
+        *columns, sqlalchemy.func.sum(Record.amount).label('value'))
+
+def rollup_totals(currency: Currency, first: datetime, last: datetime, *columns):
+    return MonthlyTotal.query.filter(
+        MonthlyTotal.user_id == current_user.id,
+        MonthlyTotal.currency_id == currency.id,
+        MonthlyTotal.month >= first,
+        MonthlyTotal.month <= last,
+    ).group_by(*columns).with_entities(
+        *columns, sqlalchemy.func.sum(MonthlyTotal.amount).label('value'))
+
+def category_totals(currency: Currency, min_date: datetime, max_date: datetime):
+    """record sums per category_id between min_date and max_date"""
+    totals = defaultdict(int)
+    first = min_date if min_date == start_of_month(min_date) else end_of_month(min_date)
+    last = start_of_month(max_date)
+    if first < last:
+        for row in rollup_totals(currency, first, last - timedelta(days=1), MonthlyTotal.category_id):
+            totals[row.category_id] += row.value
+        ranges = [(min_date, first), (last, max_date)]
+    else:
+        ranges = [(min_date, max_date)]
+
+    ranges = [(start, end) for start, end in ranges if start < end]
+    if len(ranges) > 0:
+        for row in record_totals(currency, ranges, Record.category_id):
+            totals[row.category_id] += row.value
+    return totals
+
+def monthly_totals(currency: Currency, buckets: list[tuple[datetime, datetime]], key: str):
+    """record sums per (bucket start, key), key is either 'category_id' or 'is_expense'"""
+    totals = defaultdict(int)
+    full = [
+        start for start, end in buckets
+        if start == start_of_month(start) and end == end_of_month(start)
+    ]
+    if len(full) > 0:
+        for row in rollup_totals(currency, full[0], full[-1],
+                                 MonthlyTotal.month, getattr(MonthlyTotal, key).label('key')):
+            totals[(row.month, row.key)] += row.value
+
+    partial = [(start, end) for start, end in buckets if start not in full]
+    if len(partial) > 0:
+        # calendar month works as bucket key on both sqlite and mariadb
+        year = sqlalchemy.extract('year', Transaction.date_issued)
+        month = sqlalchemy.extract('month', Transaction.date_issued)
+        column = Record.category_id if key == 'category_id' else Transaction.is_expense
+        starts = {(start.year, start.month): start for start, _ in partial}
+        for row in record_totals(currency, partial, year.label('year'), month.label('month'),
+                                 column.label('key')):
+            totals[(starts[(row.year, row.month)], row.key)] += row.value
+    return totals
+
 @nivo.route("/sunburst")
 @login_required
+@cached(chart_cache)
 @nivo_wrapper
 @is_expense_wrapper
 def sunburst(currency: Currency, is_expense: bool, min_date: datetime, max_date: datetime):
-    def agents(cat, path):
-        query = Agent.query.join(Transaction).join(Record).join(Category
-            ).filter(Transaction.currency_id == currency.id).filter(Category.id == cat.id)
-        if min_date is not None:
-            query = query.filter(Transaction.date_issued >= min_date)
-        if max_date is not None:
-            query = query.filter(Transaction.date_issued < max_date)
-        query = query.group_by(Agent).with_entities(
-                sqlalchemy.func.sum(Record.amount).label('value'), 
-                Agent.desc.label('name')
-            )
-        return [
-            dict(
-                color=cat.color,
-                id=f'{path}.{row._asdict()["name"]}',
-                **row._asdict()
-            )
-            for row in query
-        ]
-
-    def cat_obj(cat: Category, path=''):
-        cat_children = Category.query.filter_by(parent_id=cat.id, user_id=current_user.id).order_by(Category.order).all()
-
+    query = Record.query.join(Transaction).join(Agent, Agent.id == Transaction.agent_id).filter(
+        Transaction.user_id == current_user.id, Transaction.currency_id == currency.id)
+    if min_date is not None:
+        query = query.filter(Transaction.date_issued >= min_date)
+    if max_date is not None:
+        query = query.filter(Transaction.date_issued < max_date)
+    query = query.group_by(Record.category_id, Agent.id, Agent.desc).order_by(
+        Record.category_id, Agent.id
+    ).with_entities(
+        Record.category_id,
+        sqlalchemy.func.sum(Record.amount).label('value'),
+        Agent.desc.label('name')
+    )
+    agents = defaultdict(list)
+    for row in query:
+        agents[row.category_id].append(row)
+
+    tree = category_tree()
+
+    def cat_obj(cat: CategoryNode, path=''):
         path = f'{path}.{cat.desc}'
-        children = [
-            cat_obj(ch, path=path) for ch in cat_children
-        ] + agents(cat, path)
-        
         return {
             'id': path,
             'name': cat.desc,
             'color': cat.color,
-            'children': children,
+            'children': [
+                cat_obj(ch, path=path) for ch in tree.children(cat.id)
+            ] + [
+                dict(color=cat.color, id=f'{path}.{row.name}', value=row.value, name=row.name)
+                for row in agents[cat.id]
+            ],
         }
 
-    data = []
-    for cat in Category.query.filter_by(parent_id=None, user_id=current_user.id, is_expense=is_expense
-                                        ).order_by(Category.order):
-        obj = cat_obj(cat)
-        data.append(obj)
+    data = [
+        cat_obj(cat) for cat in tree.roots(is_expense)
+    ]
     return jsonify({'id': 'sunburst', 'color': '#ff0000', 'children': data})
 
 @nivo.route("/bars")
 @login_required
+@cached(chart_cache)
 @nivo_wrapper
 @is_expense_wrapper
 def bars(currency: Currency, is_expense: bool, min_date: datetime, max_date: datetime):
-        
-    def value(cat):
-        query = Category.query.filter_by(id=cat.id).join(Record).join(
-            Transaction).filter_by(currency_id=currency.id)
-        if min_date is not None:
-            query = query.filter(Transaction.date_issued >= min_date)
-        if max_date is not None:
-            query = query.filter(Transaction.date_issued < max_date)
-        query = query.group_by(Category).with_entities(
-                sqlalchemy.func.sum(Record.amount).label('value'), 
-            )
-        row = query.first()
-        if row is None:
-            return 0
-        return row._asdict()['value']
+    totals = category_totals(currency, min_date, max_date)
+    tree = category_tree()
+    colors = {cat.desc: cat.color for cat in tree.nodes.values() if cat.is_expense == is_expense}
 
     keys = []
     values = []
@@ -132,29 +218,25 @@ def bars(currency: Currency, is_expense: bool, min_date: datetime, max_date: dat
             'color': cat.color,
         }
 
-        def children(parent):
-            prevSum = sum(values)
-            v = value(parent)
+        def add_values(parent):
+            v = totals.get(parent.id, 0)
             if v > 0:
                 keys.append(parent.desc)
                 values.append(v)
-                bar[parent.desc] = value(parent)
+                bar[parent.desc] = v
                 bar[f"{parent.desc}_color"] = parent.color
-            cat_children = Category.query.filter_by(parent_id=parent.id, user_id=current_user.id).order_by(Category.order).all()
-            for child in cat_children:
-                children(child)
-            if parent.parent is None:
-                myTotal = sum(values) - prevSum
-                bar_totals[parent.desc] = myTotal
-            
-        children(cat)
+            for child in tree.children(parent.id):
+                add_values(child)
+
+        prevSum = sum(values)
+        add_values(cat)
+        bar_totals[cat.desc] = sum(values) - prevSum
         if len(bar.keys()) == 2:
             return None
         return bar
 
     data = []
-    for cat in Category.query.filter_by(parent_id=None, user_id=current_user.id, is_expense=is_expense
-                                        ).order_by(Category.order):
+    for cat in tree.roots(is_expense):
         bar = bar_obj(cat)
         if bar is not None:
             data.append(bar)
@@ -164,9 +246,7 @@ def bars(currency: Currency, is_expense: bool, min_date: datetime, max_date: dat
         for bar in data:
             if key not in bar:
                 bar[key] = 0
-                bar[f"{key}_color"] =  Category.query.filter_by(
-                    desc=key, is_expense=is_expense, user_id=current_user.id
-                ).first().color
+                bar[f"{key}_color"] = colors[key]
 
     big3 = [kv[0] for kv in sorted(bar_totals.items(), key=lambda kv: kv[1], reverse=True)[:3]]
     if len(data) > 3:
@@ -188,25 +268,24 @@ def bars(currency: Currency, is_expense: bool, min_date: datetime, max_date: dat
 
     return jsonify({'data': data, 'keys': keys, 'total': sum(values)})
 
-def end_of_month(dt: datetime):
-    return datetime(dt.year, dt.month, monthrange(dt.year, dt.month)[1], 23, 59, 59) + timedelta(seconds=1)
-
 @nivo.route("/divbars")
 @login_required
+@cached(chart_cache)
 @nivo_wrapper
 def diverging_bars(currency: Currency, min_date: datetime, max_date: datetime):
-    
+    buckets = months(min_date, max_date)
+    totals = monthly_totals(currency, buckets, 'category_id')
+    tree = category_tree()
+
     data = []
     keys = []
 
-    start = min_date
-    end = end_of_month(start)
-    while start < max_date:
+    for start, _ in buckets:
         bar = {
             'month': start.isoformat()
         }
 
-        def add_total(cat: Category):
+        def add_total(cat: CategoryNode):
             # same desc category for income & expenses, e.g. gifts
             if cat.desc in bar and not cat.is_expense:
                 key = f"{cat.desc}+"
@@ -214,13 +293,8 @@ def diverging_bars(currency: Currency, min_date: datetime, max_date: datetime):
                 key = cat.desc
             if key not in keys:
                 keys.append(key)
-            row = Record.query.filter_by(category_id=cat.id).join(
-                Transaction).filter_by(currency_id=currency.id).filter(Transaction.date_issued >= start).filter(Transaction.date_issued < end
-                ).with_entities(sqlalchemy.func.sum(Record.amount).label('value')).first()
 
-            total = row._asdict()['value']
-            if total is None:
-                total = 0
+            total = totals.get((start, cat.id), 0)
             if cat.is_expense:
                 bar[key] = total
                 bar['total_expenses'] = bar.get('total_expenses', 0) + total
@@ -229,15 +303,12 @@ def diverging_bars(currency: Currency, min_date: datetime, max_date: datetime):
                 bar['total_income'] = bar.get('total_income', 0) + total
 
             bar[f"{key}_color"] = cat.color
-            for child in Category.query.filter_by(
-                user_id=current_user.id, parent_id=cat.id).order_by(Category.order.desc()):
+            for child in reversed(tree.children(cat.id)):
                 add_total(child)
 
-        for cat in Category.query.filter_by(user_id=current_user.id, 
-                                            is_expense=True, parent_id=None).order_by(Category.order.desc()):
+        for cat in reversed(tree.roots(True)):
             add_total(cat)
-        for cat in Category.query.filter_by(user_id=current_user.id, 
-                                            is_expense=False, parent_id=None).order_by(Category.order.desc()):
+        for cat in reversed(tree.roots(False)):
             add_total(cat)
 
         bar['total_exp'] = sum([
@@ -248,10 +319,6 @@ def diverging_bars(currency: Currency, min_date: datetime, max_date: datetime):
         ])
 
         data.append(bar)
-        start = end
-        end = end_of_month(start)
-        if end > max_date:
-            end = max_date
 
     cut = 0
     while cut < len(data) and data[cut]['total_expenses'] == 0 and data[cut]['total_income'] == 0:
@@ -263,47 +330,17 @@ def diverging_bars(currency: Currency, min_date: datetime, max_date: datetime):
 
 @nivo.route("/line")
 @login_required
+@cached(chart_cache)
 @nivo_wrapper
 def line(currency: Currency, min_date: datetime, max_date: datetime):
-    start = min_date
-    end = end_of_month(start)
-
-    data = []
-
-    while start < max_date:
+    buckets = months(min_date, max_date)
+    totals = monthly_totals(currency, buckets, 'is_expense')
 
-        exp = Record.query.with_entities(
-             sqlalchemy.func.sum(Record.amount).label("sum")
-        ).join(Transaction).filter_by(
-            currency_id=currency.id,
-            is_expense=True
-        ).filter(
-            Transaction.date_issued >= start
-        ).filter(
-            Transaction.date_issued < end
-        ).first()
-        inc = Record.query.with_entities(
-             sqlalchemy.func.sum(Record.amount).label("sum")
-        ).join(Transaction).filter_by(
-            currency_id=currency.id,
-            is_expense=False
-        ).filter(
-            Transaction.date_issued >= start
-        ).filter(
-            Transaction.date_issued < end
-        ).first()
-        month = {
-            'expenses': 0 if exp is None or exp.sum is None else exp.sum,
-            'income': 0 if inc is None or inc.sum is None else inc.sum,
-            'month': start.isoformat()
-        }
-
-        data.append(month)
-        
-        start = end
-        end = end_of_month(start)
-        if end > max_date:
-            end = max_date
+    data = [{
+        'expenses': totals.get((start, True), 0),
+        'income': totals.get((start, False), 0),
+        'month': start.isoformat()
+    } for start, _ in buckets]
 
     cut = 0
     while cut < len(data) and data[cut]['expenses'] == 0 and data[cut]['income'] == 0:
@@ -314,39 +351,120 @@ def line(currency: Currency, min_date: datetime, max_date: datetime):
 
 @nivo.route("/categories")
 @login_required
+@cached(chart_cache)
 @nivo_wrapper
 @is_expense_wrapper
 def categories(currency: Currency, is_expense: bool, min_date: datetime, max_date: datetime):
+    totals = category_totals(currency, min_date, max_date)
+    tree = category_tree()
     positive = lambda d: d['total'] > 0
 
-    def compute(cat: Category):
-        query = Record.query.filter_by(
-            category_id=cat.id
-        ).with_entities(
-             sqlalchemy.func.sum(Record.amount).label("total")
-        ).join(Transaction).filter_by(
-            currency_id=currency.id
-        ).filter(
-            Transaction.date_issued >= min_date
-        ).filter(
-            Transaction.date_issued < max_date
-        ).first()
-        total = 0 if query is None or query.total is None else query.total
-        children = list(filter(positive, [
-                compute(cat) for cat in Category.query.filter_by(parent_id=cat.id, user_id=current_user.id)
-            ]))
-        totaltotal = total + sum([d['total'] for d in children])
+    def compute(cat: CategoryNode):
+        nodes = list(filter(positive, [
+            compute(child) for child in sorted(tree.children(cat.id), key=lambda node: node.id)
+        ]))
         return {
-            'category': cat.json(deep=False),
-            'total': totaltotal,
-            'children': children
+            'category': dict(cat.json),
+            'total': totals.get(cat.id, 0) + sum([d['total'] for d in nodes]),
+            'children': nodes
         }
-    
+
     data = list(filter(positive, [
-        compute(cat) for cat in Category.query.filter_by(
-            parent_id=None, user_id=current_user.id, is_expense=is_expense
-        )
+        compute(cat) for cat in sorted(tree.roots(is_expense), key=lambda node: node.id)
     ]))
 
     return jsonify(data)
 
+def bucket_index(dates, min_date: datetime, interval: str):
+    """bucket of each date counted from the bucket of min_date"""
+    if interval == 'month':
+        return (dates.astype('datetime64[M]') - np.datetime64(min_date, 'M')).astype(np.int64)
+    days = (dates.astype('datetime64[D]') - np.datetime64(min_date, 'D')).astype(np.int64)
+    return days // 7 if interval == 'week' else days
+
+def bucket_start(min_date: datetime, interval: str, index: int) -> datetime:
+    if interval == 'month':
+        start = np.datetime64(min_date, 'M') + index
+    else:
+        start = np.datetime64(min_date, 'D') + index * (7 if interval == 'week' else 1)
+    return start.astype('datetime64[us]').item()
+
+def saldo_series(opening, account, bucket, saldo, buckets: int):
+    """closing, minimal and maximal saldo of every account in every bucket.
+    Rows are ledger entries ordered by account, date and id. Buckets without
+    entries keep the saldo of the previous one."""
+    accounts = len(opening)
+    key = account * buckets + bucket
+    first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    last = np.r_[first[1:] - 1, len(key) - 1]
+
+    close = np.full(accounts * buckets, np.nan)
+    low = np.full(accounts * buckets, np.nan)
+    high = np.full(accounts * buckets, np.nan)
+    if len(key):
+        close[key[last]] = saldo[last]
+        low[key[first]] = np.minimum.reduceat(saldo, first)
+        high[key[first]] = np.maximum.reduceat(saldo, first)
+
+    # forward fill the closing saldos, starting from the opening saldos
+    filled = np.column_stack([opening, close.reshape(accounts, buckets)])
+    index = np.where(np.isnan(filled), 0, np.arange(buckets + 1))
+    np.maximum.accumulate(index, axis=1, out=index)
+    filled = filled[np.arange(accounts)[:, None], index]
+    previous, close = filled[:, :-1], filled[:, 1:]
+
+    # the saldo of the previous bucket also holds at the start of this one
+    low = np.fmin(low.reshape(accounts, buckets), previous)
+    high = np.fmax(high.reshape(accounts, buckets), previous)
+    return close.astype(np.int64), low.astype(np.int64), high.astype(np.int64)
+
+@nivo.route("/saldos")
+@login_required
+@cached(chart_cache)
+@nivo_wrapper
+def saldos(currency: Currency, min_date: datetime, max_date: datetime):
+    params = request.args.to_dict()
+    interval = params.get('interval', 'month')
+    if interval not in ['day', 'week', 'month']:
+        raise APIError(HTTPStatus.BAD_REQUEST, "interval must be 'day', 'week' or 'month'")
+    accounts = Account.query.filter_by(user_id=current_user.id, currency_id=currency.id)
+    if 'account_id' in params:
+        try:
+            accounts = accounts.filter_by(id=int(params['account_id']))
+        except ValueError:
+            raise APIError(HTTPStatus.BAD_REQUEST, 'account_id must be integer')
+    accounts = accounts.order_by(Account.id).all()
+    if not accounts or min_date >= max_date:
+        return jsonify([])
+
+    # too many buckets are merged, so the size does not depend on the history
+    last = np.array([max_date - timedelta(microseconds=1)], dtype='datetime64[us]')
+    buckets = int(bucket_index(last, min_date, interval)[0]) + 1
+    merge = -(-buckets // app.config['SALDO_SERIES_MAX_POINTS'])
+    buckets = -(-buckets // merge)
+
+    opening = np.array(saldos_at([(acc, min_date) for acc in accounts], inclusive=False),
+                       dtype=np.float64)
+    rows = db.session.execute(sqlalchemy.select(
+        LedgerEntry.account_id, LedgerEntry.date_issued, LedgerEntry.saldo
+    ).where(
+        LedgerEntry.account_id.in_([acc.id for acc in accounts]),
+        LedgerEntry.date_issued >= min_date, LedgerEntry.date_issued < max_date
+    ).order_by(LedgerEntry.account_id, *LedgerEntry.ordering())).all()
+    account_ids, dates, values = zip(*rows) if rows else ((), (), ())
+
+    # accounts and rows are both ordered by account id
+    account = np.searchsorted([acc.id for acc in accounts], np.array(account_ids, dtype=np.int64))
+    bucket = bucket_index(np.array(dates, dtype='datetime64[us]'), min_date, interval) // merge
+    close, low, high = saldo_series(
+        opening, account, bucket, np.array(values, dtype=np.float64), buckets)
+
+    starts = [bucket_start(min_date, interval, i * merge).isoformat() for i in range(buckets)]
+    return jsonify([{
+        'id': acc.desc,
+        'color': acc.color,
+        'data': [
+            {'x': start, 'y': y, 'min': lo, 'max': hi}
+            for start, y, lo, hi in zip(starts, close[i].tolist(), low[i].tolist(), high[i].tolist())
+        ]
+    } for i, acc in sorted(enumerate(accounts), key=lambda item: item[1].order)])
@@ -1,5 +1,8 @@
 from datetime import datetime
 from http import HTTPStatus
+from math import ceil
+
+import sqlalchemy
 
 from finnance.errors import APIError
 
@@ -10,6 +13,29 @@ class ModelID:
         else:
             self.id = int(id_param)
 
+class Cursor:
+    """position after the last row of a page ordered by (date_issued, id) descending"""
+    def __init__(self, cursor_param):
+        date_issued, id_param = cursor_param.rsplit('_', 1)
+        self.date_issued = datetime.fromisoformat(date_issued)
+        self.id = int(id_param)
+
+    @staticmethod
+    def encode(obj):
+        return f'{obj.date_issued.isoformat()}_{obj.id}'
+
+class AccountDate:
+    """an account at a point in time, '<account_id>_<isoformat>'"""
+    def __init__(self, param):
+        account_id, date = param.split('_', 1)
+        self.account_id = int(account_id)
+        self.date = datetime.fromisoformat(date)
+
+def flag(param):
+    if param not in ['true', 'false']:
+        raise ValueError
+    return param == 'true'
+
 def parseSearchParams(params: dict[str, str], template: dict[str, type]):
     template.update(pagesize=int, page=int)
     parsed = dict(pagesize=10, page=0)
@@ -22,4 +48,24 @@ def parseSearchParams(params: dict[str, str], template: dict[str, type]):
                     parsed[key] = template[key](val)
             except ValueError:
                 raise APIError(HTTPStatus.BAD_REQUEST, f'invalid search param {key}')
-    return parsed
\ No newline at end of file
+    return parsed
+
+def filterSearchParams(query, params: dict, date_column, search_columns: list):
+    """applies start, end and search of parsed search params as SQL predicates"""
+    if 'start' in params:
+        query = query.filter(date_column >= params['start'])
+    if 'end' in params:
+        query = query.filter(date_column < params['end'])
+    if 'search' in params:
+        query = query.filter(sqlalchemy.or_(*[
+            column.icontains(params['search'], autoescape=True)
+            for column in search_columns
+        ]))
+    return query
+
+def paginate(query, params: dict):
+    """returns the number of pages and the items of the requested page"""
+    pagesize = params['pagesize']
+    page = params['page']
+    pages = ceil(query.count() / pagesize)
+    return pages, query.limit(pagesize).offset(pagesize*page).all()
\ No newline at end of file
@@ -1,10 +1,10 @@
 from datetime import datetime
-from math import ceil
 
-from finnance.params import parseSearchParams
-from finnance.models import Record, Transaction, JSONModel
+from finnance.params import filterSearchParams, paginate, parseSearchParams
+from finnance.models import Category, Record, Transaction, JSONModel
 from flask import Blueprint, request
 from flask_login import current_user, login_required
+from sqlalchemy.orm import contains_eager
 
 records = Blueprint('records', __name__, url_prefix='/api/records')
 
@@ -15,27 +15,19 @@ def get_records():
         start=datetime, end=datetime, search=str
     ))
 
-    result = Record.query.join(Transaction).filter_by(user_id=current_user.id).order_by(Transaction.date_issued.desc())
-    if 'start' in kwargs:
-        result = result.filter(Transaction.date_issued >= kwargs.get('start'))
-    if 'end' in kwargs:
-        result = result.filter(Transaction.date_issued < kwargs.get('end'))
-    
-    pagesize = kwargs.get('pagesize')
-    page = kwargs.get('page')
+    result = Record.query.join(Transaction).join(Category, Category.id == Record.category_id).filter(
+        Transaction.user_id == current_user.id
+    ).options(
+        contains_eager(Record.trans), contains_eager(Record.category)
+    ).order_by(Transaction.date_issued.desc(), Transaction.id.desc(), Record.id)
+    result = filterSearchParams(result, kwargs, Transaction.date_issued,
+                                [Transaction.comment, Category.desc])
 
-    # search filter
-    result = list(filter(
-        lambda r: 'search' not in kwargs or any(
-            kwargs['search'].lower() in string for string in [
-                r.trans.comment.lower(),
-                r.category.desc.lower(),
-        ]),
-        result.all()
-    ))
+    pages, result = paginate(result, kwargs)
+    Category.load_parents(record.category for record in result)
     return JSONModel.obj_to_api(dict(
-        pages= ceil(len(result) / pagesize),
+        pages=pages,
         records=[
         record.json(deep=True)
-        for record in result[pagesize*page:pagesize*(page+1)]
+        for record in result
     ]))
\ No newline at end of file
@@ -0,0 +1 @@
+from .rollup import contributions, month_of, rebuild, rollup_cli, update
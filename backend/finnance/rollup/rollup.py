@@ -0,0 +1,116 @@
+from collections import defaultdict
+from datetime import datetime
+
+import click
+import sqlalchemy
+from finnance.cache import bump_version
+from finnance.models import MonthlyTotal, Record, Transaction, User
+from flask.cli import AppGroup
+
+from finnance import db
+
+rollup_cli = AppGroup('rollup', help='Maintain the monthly totals used by the charts.')
+
+# record sums per (user, currency, category, month, is_expense). A
+# transaction contributes one (key, amount) pair per record, writes remove
+# the contributions of the old state and add the ones of the new state.
+
+def month_of(date: datetime):
+    return datetime(date.year, date.month, 1)
+
+def contributions(trans: Transaction):
+    key = (trans.user_id, trans.currency_id, month_of(trans.date_issued), trans.is_expense)
+    return [
+        (key + (rec.category_id,), rec.amount)
+        for rec in Record.query.filter_by(trans_id=trans.id)
+    ]
+
+def update(removed=(), added=()):
+    deltas = defaultdict(lambda: [0, 0])
+    for key, amount in removed:
+        deltas[key][0] -= amount
+        deltas[key][1] -= 1
+    for key, amount in added:
+        deltas[key][0] += amount
+        deltas[key][1] += 1
+
+    for (user_id, currency_id, month, is_expense, category_id), (amount, count) in deltas.items():
+        if amount == 0 and count == 0:
+            continue
+        where = (MonthlyTotal.user_id == user_id, MonthlyTotal.currency_id == currency_id,
+                 MonthlyTotal.month == month, MonthlyTotal.is_expense == is_expense,
+                 MonthlyTotal.category_id == category_id)
+        # incremented in SQL, concurrent writes to a row must not overwrite each other
+        if _increment(where, amount, count) == 0:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(MonthlyTotal(
+                        user_id=user_id, currency_id=currency_id, month=month,
+                        is_expense=is_expense, category_id=category_id, amount=amount, count=count
+                    ))
+            except sqlalchemy.exc.IntegrityError:
+                # another worker inserted the row first
+                _increment(where, amount, count)
+        if count < 0:
+            MonthlyTotal.query.filter(*where, MonthlyTotal.count <= 0).delete()
+
+def _increment(where: tuple, amount: int, count: int) -> int:
+    return db.session.execute(sqlalchemy.update(MonthlyTotal).where(*where).values(
+        amount=MonthlyTotal.amount + amount, count=MonthlyTotal.count + count
+    )).rowcount
+
+def _aggregate():
+    year = sqlalchemy.extract('year', Transaction.date_issued)
+    month = sqlalchemy.extract('month', Transaction.date_issued)
+    query = db.session.query(
+        Transaction.user_id, Transaction.currency_id, year.label('year'), month.label('month'),
+        Transaction.is_expense, Record.category_id,
+        sqlalchemy.func.sum(Record.amount).label('amount'),
+        sqlalchemy.func.count(Record.id).label('count'),
+    ).join(Record, Record.trans_id == Transaction.id).group_by(
+        Transaction.user_id, Transaction.currency_id, year, month,
+        Transaction.is_expense, Record.category_id
+    )
+    return {
+        (row.user_id, row.currency_id, datetime(row.year, row.month, 1),
+         row.is_expense, row.category_id): (row.amount, row.count)
+        for row in query
+    }
+
+def _drift(actual: dict):
+    stored = {
+        (row.user_id, row.currency_id, row.month, row.is_expense, row.category_id):
+            (row.amount, row.count)
+        for row in MonthlyTotal.query
+    }
+    return sum(stored.get(key) != actual.get(key) for key in stored.keys() | actual.keys())
+
+def rebuild() -> int:
+    """recompute all monthly totals from the records, returns the number of drifted rows"""
+    actual = _aggregate()
+    drift = _drift(actual)
+    MonthlyTotal.query.delete()
+    db.session.add_all([
+        MonthlyTotal(user_id=user_id, currency_id=currency_id, month=month,
+                     is_expense=is_expense, category_id=category_id, amount=amount, count=count)
+        for (user_id, currency_id, month, is_expense, category_id), (amount, count) in actual.items()
+    ])
+    return drift
+
+@rollup_cli.command('rebuild')
+def rebuild_command():
+    """Recompute all monthly totals from the records."""
+    drift = rebuild()
+    db.session.commit()
+    # cached charts were computed from the old totals
+    for user in User.query:
+        bump_version(user.id)
+    click.echo(f"monthly totals rebuilt, {drift} drifted rows fixed")
+
+@rollup_cli.command('verify')
+def verify_command():
+    """Compare the monthly totals against the records without writing."""
+    drift = _drift(_aggregate())
+    click.echo(f"{drift} drifted rows")
+    if drift:
+        raise SystemExit(1)
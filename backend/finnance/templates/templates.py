@@ -1,7 +1,7 @@
 from datetime import datetime
 from http import HTTPStatus
 
-from finnance.agents import create_agent_ifnx
+from finnance.agents import resolve_agents
 from finnance.errors import APIError, validate
 from finnance.models import (Account, Category, Currency, FlowTemplate,
                              JSONModel, RecordTemplate, TransactionTemplate)
@@ -15,9 +15,9 @@ templates = Blueprint('templates', __name__, url_prefix='/api/templates')
 @templates.route("")
 @login_required
 def all_templates():
-    temps = TransactionTemplate.query.filter_by(
-        user_id=current_user.id).order_by(TransactionTemplate.order.asc()).all()
-    return JSONModel.obj_to_api([temp.json(deep=True) for temp in temps])
+    temps = TransactionTemplate.query.options(*TransactionTemplate.loaders()).filter_by(
+        user_id=current_user.id).order_by(TransactionTemplate.order.asc())
+    return JSONModel.stream_api(temps, lambda temp: temp.json(deep=True))
 
 @templates.route("/add", methods=["POST"])
 @login_required
@@ -81,19 +81,20 @@ def add_template(**data):
         if cat is None:
             raise APIError(HTTPStatus.BAD_REQUEST, 'invalid category_id')
     
+    flows = [] if 'remote_agent' in data else data.pop('flows')
+    agents = resolve_agents([data[key] for key in ['agent', 'remote_agent'] if key in data]
+                            + [flow['agent'] for flow in flows if 'agent' in flow])
+
     if 'agent' in data:
-        agent = create_agent_ifnx(data.pop('agent'))
+        agent = agents[data.pop('agent')]
         data['agent_id'] = agent.id
     
     if 'remote_agent' in data:
-        agent = create_agent_ifnx(data.pop('remote_agent'))
+        agent = agents[data.pop('remote_agent')]
         data['remote_agent_id'] = agent.id
-        flows = []
-    else:
-        flows = data.pop('flows')
 
     for flow in flows:
-        flow['agent_id'] = create_agent_ifnx(flow.pop('agent')).id if 'agent' in flow else None
+        flow['agent_id'] = agents[flow.pop('agent')].id if 'agent' in flow else None
 
     order = max([temp.order for temp in current_user.templates] + [0]) + 1
     temp = TransactionTemplate(**data, user_id=current_user.id, order=order)
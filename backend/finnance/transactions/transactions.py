@@ -1,23 +1,33 @@
+import csv
+import io
+import json
 from datetime import datetime
 from http import HTTPStatus
 from math import ceil
 
-from finnance.agents import create_agent_ifnx
+import sqlalchemy
+from finnance.agents import resolve_agents
 from finnance.errors import APIError, validate
-from finnance.models import (Account, Category, Currency, Flow, Record,
+from finnance.ledger import post_transaction, rebuild, unpost_transaction
+from finnance.models import (Account, Agent, Category, Currency, Flow, Record,
                              Transaction, JSONModel)
-from finnance.params import parseSearchParams, ModelID
+from finnance.params import (Cursor, ModelID, filterSearchParams, flag,
+                             parseSearchParams)
+from finnance.rollup import contributions, month_of, update
+from finnance.usage import agent_uses, update_uses
 from flask import Blueprint, jsonify, request
 from flask_login import current_user, login_required
+from jsonschema import Draft202012Validator
 
-from finnance import db
+from finnance import app, db
 
 transactions = Blueprint('transactions', __name__, url_prefix='/api/transactions')
 
 @transactions.route("/<int:transaction_id>")
 @login_required
 def transaction(transaction_id: int):
-    trans = Transaction.query.filter_by(id=transaction_id, user_id=current_user.id).first()
+    trans = Transaction.query.options(*Transaction.loaders()).filter_by(
+        id=transaction_id, user_id=current_user.id).first()
     if trans is None:
         raise APIError(HTTPStatus.NOT_FOUND)
     return trans.api()
@@ -26,40 +36,56 @@ def transaction(transaction_id: int):
 @login_required
 def get_transactions():
     kwargs = parseSearchParams(request.args.to_dict(), dict(
-        start=datetime, end=datetime, account_id=ModelID, search=str
+        start=datetime, end=datetime, account_id=ModelID, search=str,
+        cursor=Cursor, count=flag
     ))
 
-    result = Transaction.query.filter_by(user_id=current_user.id).order_by(Transaction.date_issued.desc())
-    if 'start' in kwargs:
-        result = result.filter(Transaction.date_issued >= kwargs.get('start'))
-    if 'end' in kwargs:
-        result = result.filter(Transaction.date_issued < kwargs.get('end'))
+    # remote transactions are matched by the agent of their first flow
+    remote_agent = sqlalchemy.select(Agent.desc).join(
+        Flow, Flow.agent_id == Agent.id
+    ).where(Flow.trans_id == Transaction.id).order_by(Flow.id).limit(1).scalar_subquery()
+
+    result = Transaction.query.filter_by(user_id=current_user.id)
     if 'account_id' in kwargs:
         result = result.filter_by(account_id=kwargs['account_id'].id)
-    
+    if 'search' in kwargs:
+        result = result.join(Agent, Agent.id == Transaction.agent_id).join(
+            Account, Account.id == Transaction.account_id, isouter=True)
+    result = filterSearchParams(result, kwargs, Transaction.date_issued, [
+        Transaction.comment, Agent.desc,
+        sqlalchemy.case((Transaction.account_id.is_(None), remote_agent), else_=Account.desc)
+    ])
+
     pagesize = kwargs.get('pagesize')
     page = kwargs.get('page')
 
-    # search filter
-    result = list(filter(
-        lambda t: 'search' not in kwargs or any(
-            kwargs['search'].lower() in string for string in [
-                t.comment.lower(),
-                t.agent.desc.lower(),
-                t.account.desc.lower() if t.account_id is not None else t.flows[0].agent_desc
-        ]),
-        result.all()
-    ))
+    # the total is an extra query, clients paging by cursor can skip it
+    pages = ceil(result.count() / pagesize) if kwargs.get('count', True) else None
+
+    result = result.order_by(Transaction.date_issued.desc(), Transaction.id.desc())
+    if 'cursor' in kwargs:
+        cursor = kwargs['cursor']
+        result = result.filter(sqlalchemy.or_(
+            Transaction.date_issued < cursor.date_issued,
+            sqlalchemy.and_(Transaction.date_issued == cursor.date_issued,
+                            Transaction.id < cursor.id)
+        ))
+    else:
+        result = result.offset(pagesize*page)
+    # one extra row tells whether there is a next page
+    result = result.options(*Transaction.loaders()).limit(pagesize + 1).all()
+    Account.load_saldos(trans.account for trans in result if trans.account is not None)
+
     return JSONModel.obj_to_api(dict(
-        pages= ceil(len(result) / pagesize),
+        pages=pages,
+        next_cursor=Cursor.encode(result[pagesize - 1]) if len(result) > pagesize else None,
         transactions=[
         trans.json(deep=True)
-        for trans in result[pagesize*page:pagesize*(page+1)]
+        for trans in result[:pagesize]
     ]))
 
-@transactions.route("/add", methods=["POST"])
-@login_required
-@validate({
+# schema of a new transaction, shared by /add and /import
+transaction_schema = {
     "type": "object",
     "properties": {
         "account_id": {"type": "integer"},
@@ -95,7 +121,11 @@ def get_transactions():
         },
     },
     "required": ["currency_id", "amount", "date_issued", "is_expense", "agent", "comment", "direct", "flows", "records"]
-})
+}
+
+@transactions.route("/add", methods=["POST"])
+@login_required
+@validate(transaction_schema)
 def add_trans(**data):
     data['date_issued'] = datetime.fromisoformat(data.pop('date_issued'))
 
@@ -118,36 +148,23 @@ def add_trans(**data):
         if cat is None:
             raise APIError(HTTPStatus.BAD_REQUEST, 'invalid category_id')
     # AGENTs
-    agent = create_agent_ifnx(data.pop('agent'))
+    flows = initial_flows(data)
+    agents = resolve_agents([data['agent']] + [flow['agent'] for flow in flows])
+    agent = agents[data.pop('agent')]
     data['agent_id'] = agent.id
-    
-    if 'remote_agent' in data and len(data['remote_agent']):
-        flows = [{
-            'agent': data['remote_agent'],
-            'is_debt': data['is_expense'],
-            'amount': data['amount']
-        }]
-    elif data['direct']:
-        flows = [{
-            'agent': agent.desc,
-            'is_debt': not data['is_expense'],
-            'amount': data['amount']
-        }]
-    else:
-        flows = data['flows']
-        for flow in flows:
-            flow['is_debt'] = not data['is_expense']
 
     data.pop('direct')
     data.pop('remote_agent', 0) # not necessarily included
     data.pop('flows')
 
     for flow in flows:
-        flow['agent_id'] = create_agent_ifnx(flow.pop('agent')).id
+        flow['agent_id'] = agents[flow.pop('agent')].id
 
     trans = Transaction(**data, user_id=current_user.id)
     db.session.add(trans)
-    db.session.commit()
+    # the ledger, totals and counters are committed together with trans
+    db.session.flush()
+    post_transaction(trans)
     for record in records:
         db.session.add(
             Record(**record, trans_id=trans.id)
@@ -156,10 +173,28 @@ def add_trans(**data):
         db.session.add(
             Flow(**flow, trans_id=trans.id)
         )
+    update(added=contributions(trans))
+    update_uses(added=agent_uses(trans))
     db.session.commit()
         
     return '', HTTPStatus.CREATED
 
+def initial_flows(data: dict):
+    """flows of a new transaction from its remote_agent, direct and flows fields"""
+    if 'remote_agent' in data and len(data['remote_agent']):
+        return [{
+            'agent': data['remote_agent'],
+            'is_debt': data['is_expense'],
+            'amount': data['amount']
+        }]
+    if data['direct']:
+        return [{
+            'agent': data['agent'],
+            'is_debt': not data['is_expense'],
+            'amount': data['amount']
+        }]
+    return [dict(flow, is_debt=not data['is_expense']) for flow in data['flows']]
+
 @transactions.route("/<int:transaction_id>/edit", methods=["PUT"])
 @login_required
 @validate({
@@ -203,6 +238,9 @@ def edit_transaction(transaction_id: int, **data):
     if trans is None:
         raise APIError(HTTPStatus.NOT_FOUND)
 
+    before = contributions(trans)
+    uses_before = agent_uses(trans)
+
     if 'date_issued' in data:
         issued = datetime.fromisoformat(data.pop('date_issued'))
         if issued != trans.date_issued:
@@ -227,8 +265,8 @@ def edit_transaction(transaction_id: int, **data):
 
     agent = None
     if 'agent' in data and data['agent'] != trans.agent.desc:
-        agent = create_agent_ifnx(data.pop('agent'))
-        db.session.commit()
+        desc = data.pop('agent')
+        agent = resolve_agents([desc])[desc]
         trans.agent_id = agent.id
     
     if 'comment' in data and data['comment'] != trans.comment:
@@ -266,9 +304,9 @@ def edit_transaction(transaction_id: int, **data):
     data.pop('flows', 0)
     
     if flows is not None:
+        agents = resolve_agents(flow_data['agent'] for flow_data in flows)
         for flow_data, flow in zip(flows, trans.flows):
-            agent = create_agent_ifnx(flow_data['agent'])
-            flow.agent_id = agent.id
+            flow.agent_id = agents[flow_data['agent']].id
             flow.is_debt = flow_data['is_debt']
             flow.amount = flow_data['amount']
 
@@ -277,7 +315,7 @@ def edit_transaction(transaction_id: int, **data):
         
         for flow_data in flows[len(trans.flows):]:
             flow = Flow(
-                agent_id = create_agent_ifnx(flow_data.pop('agent')).id,
+                agent_id = agents[flow_data.pop('agent')].id,
                 is_debt = flow_data['is_debt'],
                 amount = flow_data['amount'],
                 trans_id = transaction_id
@@ -310,6 +348,10 @@ def edit_transaction(transaction_id: int, **data):
             )
             db.session.add(rec)
 
+    unpost_transaction(trans)
+    post_transaction(trans)
+    update(removed=before, added=contributions(trans))
+    update_uses(removed=uses_before, added=agent_uses(trans))
     db.session.commit()
         
     return '', HTTPStatus.CREATED
@@ -321,11 +363,164 @@ def delete_transaction(transaction_id: int):
     if trans is None:
         raise APIError(HTTPStatus.NOT_FOUND)
     
+    unpost_transaction(trans)
+    update(removed=contributions(trans))
+    uses = agent_uses(trans)
     for flow in trans.flows:
         db.session.delete(flow)
     for rec in trans.records:
         db.session.delete(rec)
     db.session.delete(trans)
+    update_uses(removed=uses)
+    db.session.commit()
+
+    return '', HTTPStatus.OK
+
+# columns of a csv import, every row is one direct transaction with a single
+# record, or a remote one if remote_agent is set
+csv_columns = dict(
+    date_issued=str, amount=int, is_expense=flag, agent=str, comment=str,
+    account_id=int, currency_id=int, category_id=int, remote_agent=str
+)
+
+def csv_transaction(row: dict):
+    data = {}
+    for key, parse in csv_columns.items():
+        if row.get(key) in (None, ''):
+            continue
+        try:
+            data[key] = parse(row[key])
+        except ValueError:
+            raise ValueError(f'invalid {key}')
+    data.setdefault('comment', '')
+    category_id = data.pop('category_id', None)
+    data['records'] = [] if category_id is None else [
+        dict(amount=data.get('amount'), category_id=category_id)
+    ]
+    data['direct'] = 'remote_agent' not in data
+    data['flows'] = []
+    return data
+
+def import_error(data: dict, accounts: dict, currencies: set, categories: set):
+    """checks a schema valid transaction against the user's data, returns the error message"""
+    try:
+        data['date_issued'] = datetime.fromisoformat(data['date_issued'])
+    except ValueError:
+        return 'date_issued: invalid isoformat'
+    if 'account_id' in data:
+        account = accounts.get(data['account_id'])
+        if account is None:
+            return 'invalid account_id'
+        if account.currency_id != data['currency_id']:
+            return 'account and currency don\'t match'
+    elif data['currency_id'] not in currencies:
+        return 'invalid currency_id'
+    category_ids = [record['category_id'] for record in data['records']]
+    if not categories.issuperset(category_ids):
+        return 'invalid category_id'
+    if len(set(category_ids)) < len(category_ids):
+        return 'duplicate category_id'
+    agents = [flow['agent'] for flow in data['flows']]
+    if len(set(agents)) < len(agents):
+        return 'duplicate flow agent'
+    return None
+
+@transactions.route("/import", methods=["POST"])
+@login_required
+def import_transactions():
+    kwargs = parseSearchParams(request.args.to_dict(), dict(strict=flag))
+
+    if request.mimetype == 'text/csv':
+        rows = []
+        for row in csv.DictReader(io.StringIO(request.get_data(as_text=True))):
+            try:
+                rows.append(csv_transaction(row))
+            except ValueError as err:
+                rows.append(err)
+    else:
+        try:
+            rows = json.loads(request.data.decode())
+        except json.decoder.JSONDecodeError:
+            raise APIError(HTTPStatus.BAD_REQUEST, "Non-JSON format")
+        if not isinstance(rows, list):
+            raise APIError(HTTPStatus.BAD_REQUEST, "expected an array of transactions")
+    if len(rows) > app.config['IMPORT_MAX_ROWS']:
+        raise APIError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                       f"at most {app.config['IMPORT_MAX_ROWS']} transactions per import")
+
+    errors = {}
+    validator = Draft202012Validator(schema=transaction_schema)
+    for i, data in enumerate(rows):
+        if isinstance(data, ValueError):
+            errors[i] = str(data)
+            continue
+        error = next(validator.iter_errors(data), None)
+        if error is not None:
+            errors[i] = f"Invalid JSON schema: {error.message}"
+    valid = [(i, data) for i, data in enumerate(rows) if i not in errors]
+
+    # one query per referenced table instead of one per row
+    accounts = {acc.id: acc for acc in Account.query.filter(
+        Account.user_id == current_user.id,
+        Account.id.in_({data['account_id'] for _, data in valid if 'account_id' in data})
+    )}
+    currencies = set(db.session.scalars(sqlalchemy.select(Currency.id).where(
+        Currency.user_id == current_user.id,
+        Currency.id.in_({data['currency_id'] for _, data in valid})
+    )))
+    categories = set(db.session.scalars(sqlalchemy.select(Category.id).where(
+        Category.user_id == current_user.id,
+        Category.id.in_({rec['category_id'] for _, data in valid for rec in data['records']})
+    )))
+    for i, data in valid:
+        error = import_error(data, accounts, currencies, categories)
+        if error is not None:
+            errors[i] = error
+    valid = [data for i, data in valid if i not in errors]
+
+    report = dict(
+        imported=0 if errors and kwargs.get('strict', False) else len(valid),
+        errors=[dict(row=i, error=error) for i, error in sorted(errors.items())]
+    )
+    if report['imported'] == 0:
+        return jsonify(report), HTTPStatus.BAD_REQUEST if errors else HTTPStatus.OK
+
+    for data in valid:
+        data['flows'] = initial_flows(data)
+    agents = resolve_agents([data['agent'] for data in valid] + [
+        flow['agent'] for data in valid for flow in data['flows']])
+
+    # the unit of work writes every table with one multi row insert
+    added = []
+    uses = []
+    for data in valid:
+        trans = Transaction(
+            amount=data['amount'], is_expense=data['is_expense'], currency_id=data['currency_id'],
+            account_id=data.get('account_id'), agent=agents[data['agent']],
+            date_issued=data['date_issued'], comment=data['comment'], user_id=current_user.id
+        )
+        db.session.add(trans)
+        db.session.add_all([
+            Record(amount=rec['amount'], category_id=rec['category_id'], trans=trans)
+            for rec in data['records']
+        ])
+        db.session.add_all([
+            Flow(amount=flow['amount'], is_debt=flow['is_debt'],
+                 agent=agents[flow['agent']], trans=trans)
+            for flow in data['flows']
+        ])
+        key = (current_user.id, trans.currency_id, month_of(trans.date_issued), trans.is_expense)
+        added += [(key + (rec['category_id'],), rec['amount']) for rec in data['records']]
+        uses += [(current_user.id, agents[desc].id, trans.date_issued)
+                 for desc in [data['agent']] + [flow['agent'] for flow in data['flows']]]
+    db.session.flush()
+
+    # one recomputation per account is cheaper than shifting its later
+    # entries once per imported transaction
+    for account_id in {data['account_id'] for data in valid if 'account_id' in data}:
+        rebuild(accounts[account_id])
+    update(added=added)
+    update_uses(added=uses)
     db.session.commit()
 
-    return '', HTTPStatus.OK
\ No newline at end of file
+    return jsonify(report), HTTPStatus.CREATED
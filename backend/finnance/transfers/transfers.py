@@ -2,6 +2,7 @@ from datetime import datetime
 from http import HTTPStatus
 
 from finnance.errors import APIError, validate
+from finnance.ledger import post_transfer, unpost_transfer
 from finnance.models import Account, AccountTransfer, Currency
 from flask import Blueprint, jsonify
 from flask_login import current_user, login_required
@@ -13,7 +14,8 @@ transfers = Blueprint('transfers', __name__, url_prefix='/api/transfers')
 @transfers.route("/<int:transfer_id>")
 @login_required
 def transfer(transfer_id: int):
-    transfer = AccountTransfer.filter_by(user_id=current_user.id, id=transfer_id).first()
+    transfer = AccountTransfer.query.options(*AccountTransfer.loaders()).filter_by(
+        user_id=current_user.id, id=transfer_id).first()
     if transfer is None:
         raise APIError(HTTPStatus.NOT_FOUND)
 
@@ -53,6 +55,8 @@ def add_transfer(src_id: int, dst_id: int, src_amount: int, dst_amount: int, dat
     transfer = AccountTransfer(src_id=src_id, dst_id=dst_id, src_amount=src_amount, dst_amount=dst_amount,
         date_issued=date_issued, comment=comment, user_id=current_user.id)
     db.session.add(transfer)
+    db.session.flush()
+    post_transfer(transfer)
     db.session.commit()
     return '', HTTPStatus.CREATED
 
@@ -109,6 +113,8 @@ def edit_transfer(transfer_id: int, **data):
     if 'comment' in data:
         transfer.comment = data['comment']
 
+    unpost_transfer(transfer)
+    post_transfer(transfer)
     db.session.commit()
     return '', HTTPStatus.CREATED
 
@@ -119,6 +125,7 @@ def delete_transfer(transfer_id: int):
     if tf is None:
         raise APIError(HTTPStatus.NOT_FOUND)
     
+    unpost_transfer(tf)
     db.session.delete(tf)
     db.session.commit()
 
@@ -0,0 +1 @@
+from .usage import agent_uses, rebuild, update_uses, usage_cli
\ No newline at end of file
@@ -0,0 +1,118 @@
+from collections import defaultdict
+
+import click
+import sqlalchemy
+from finnance.cache import bump_version
+from finnance.models import Agent, AgentUsage, Flow, Transaction, User
+from flask.cli import AppGroup
+
+from finnance import db
+
+usage_cli = AppGroup('usage', help='Maintain the agent usage counters.')
+
+# every agent has a row with the number of transactions and flows using it
+# and the date of the latest one. A transaction contributes one
+# (user, agent, date) triple for its agent and one for each flow.
+
+def agent_uses(trans: Transaction):
+    return [(trans.user_id, trans.agent_id, trans.date_issued)] + [
+        (trans.user_id, flow.agent_id, trans.date_issued)
+        for flow in Flow.query.filter_by(trans_id=trans.id)
+    ]
+
+def last_used(agent_id: int):
+    """date of the latest transaction or flow of the agent, as a scalar subquery"""
+    flows = sqlalchemy.select(Flow.trans_id).where(Flow.agent_id == agent_id)
+    return sqlalchemy.select(sqlalchemy.func.max(Transaction.date_issued)).where(
+        sqlalchemy.or_(Transaction.agent_id == agent_id, Transaction.id.in_(flows))
+    ).scalar_subquery()
+
+def update_uses(removed=(), added=()):
+    """applies the uses of a write, call it after its deletes are in the session"""
+    deltas = defaultdict(int)
+    users = {}
+    latest_removed = {}
+    latest_added = {}
+    for user_id, agent_id, date_issued in removed:
+        deltas[agent_id] -= 1
+        users[agent_id] = user_id
+        latest_removed[agent_id] = max(latest_removed.get(agent_id, date_issued), date_issued)
+    for user_id, agent_id, date_issued in added:
+        deltas[agent_id] += 1
+        users[agent_id] = user_id
+        latest_added[agent_id] = max(latest_added.get(agent_id, date_issued), date_issued)
+
+    for agent_id, delta in deltas.items():
+        latest = AgentUsage.last_used
+        if agent_id in latest_added:
+            latest = sqlalchemy.case((sqlalchemy.or_(
+                AgentUsage.last_used.is_(None), AgentUsage.last_used < latest_added[agent_id]
+            ), latest_added[agent_id]), else_=latest)
+        if agent_id in latest_removed:
+            # the latest use may be gone
+            latest = sqlalchemy.case(
+                (AgentUsage.last_used <= latest_removed[agent_id], last_used(agent_id)), else_=latest)
+        # changed in SQL, concurrent writes for an agent must not overwrite each other
+        if _change(agent_id, delta, latest) == 0:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(AgentUsage(agent_id=agent_id, user_id=users[agent_id], uses=delta,
+                                              last_used=latest_added.get(agent_id)))
+            except sqlalchemy.exc.IntegrityError:
+                # another worker inserted the row first
+                _change(agent_id, delta, latest)
+
+def _change(agent_id: int, delta: int, latest) -> int:
+    return db.session.execute(sqlalchemy.update(AgentUsage).where(
+        AgentUsage.agent_id == agent_id
+    ).values(uses=AgentUsage.uses + delta, last_used=latest)).rowcount
+
+def _aggregate():
+    actual = {agent.id: (agent.user_id, 0, None) for agent in Agent.query}
+    by_trans = db.session.query(
+        Transaction.agent_id.label('agent_id'), Transaction.date_issued)
+    by_flow = db.session.query(Flow.agent_id.label('agent_id'), Transaction.date_issued).join(
+        Transaction, Transaction.id == Flow.trans_id)
+    for query in [by_trans, by_flow]:
+        sub = query.subquery()
+        for row in db.session.query(
+            sub.c.agent_id, sqlalchemy.func.count().label('uses'),
+            sqlalchemy.func.max(sub.c.date_issued).label('last_used')
+        ).group_by(sub.c.agent_id):
+            user_id, uses, last = actual[row.agent_id]
+            actual[row.agent_id] = (user_id, uses + row.uses,
+                                    row.last_used if last is None else max(last, row.last_used))
+    return actual
+
+def _drift(actual: dict):
+    stored = {row.agent_id: (row.user_id, row.uses, row.last_used) for row in AgentUsage.query}
+    return sum(stored.get(key) != actual.get(key) for key in stored.keys() | actual.keys())
+
+def rebuild() -> int:
+    """recompute the usage counters of all agents, returns the number of drifted rows"""
+    actual = _aggregate()
+    drift = _drift(actual)
+    AgentUsage.query.delete()
+    db.session.add_all([
+        AgentUsage(agent_id=agent_id, user_id=user_id, uses=uses, last_used=last)
+        for agent_id, (user_id, uses, last) in actual.items()
+    ])
+    return drift
+
+@usage_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the usage counters of all agents."""
+    drift = rebuild()
+    db.session.commit()
+    # cached agent lists are ranked by the old counters
+    for user in User.query:
+        bump_version(user.id)
+    click.echo(f"agent usage rebuilt, {drift} drifted rows fixed")
+
+@usage_cli.command('verify')
+def verify_command():
+    """Compare the usage counters against the transactions without writing."""
+    drift = _drift(_aggregate())
+    click.echo(f"{drift} drifted rows")
+    if drift:
+        raise SystemExit(1)
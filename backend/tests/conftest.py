@@ -0,0 +1,64 @@
+import json
+import os
+import random
+import tempfile
+
+import pytest
+
+# finnance creates its database on import, point it to a scratch file first
+DB_DIR = tempfile.mkdtemp()
+os.environ['FLASK_DEBUG'] = '1'
+os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(DB_DIR, 'test.db')
+
+from finnance import app as finnance_app
+
+
+@pytest.fixture(scope='session')
+def app():
+    return finnance_app
+
+
+@pytest.fixture(scope='session')
+def client(app):
+    """logged in client of a user with two currencies, nested categories and a
+    few years of transactions"""
+    client = app.test_client()
+    rng = random.Random(4)
+
+    def post(url, data, method='post'):
+        response = getattr(client, method)(url, data=json.dumps(data))
+        assert response.status_code in (200, 201), (url, response.data)
+
+    post('/api/auth/register', dict(username='finn', email='finn@example.com', password='secret1'))
+    post('/api/auth/login', dict(username='finn', password='secret1'))
+    for code in ('CHF', 'EUR'):
+        post('/api/currencies/add', dict(code=code, decimals=2))
+    for i in range(3):
+        post('/api/accounts/add', dict(desc=f'acc{i}', color='#aabbcc', starting_saldo=1000 * i,
+                                       date_created='2019-01-01T00:00:00', currency_id=1 + i // 2))
+
+    # ids 1-5 expenses, 6-10 incomes, then two children each below 1, 2 and 6
+    for is_expense in (True, False):
+        for i in range(5):
+            post('/api/categories/add', dict(desc=f'cat{i}', is_expense=is_expense, usable=True,
+                                             color=f'#{i}{i}{i}{i}{i}{i}', parent_id=None))
+    for parent in (1, 2, 6):
+        for i in range(2):
+            post('/api/categories/add', dict(desc=f'sub{parent}_{i}', is_expense=parent < 6,
+                                             usable=True, color='#22aa33', parent_id=parent))
+    expenses, incomes = [1, 2, 3, 4, 5, 11, 12, 13, 14], [6, 7, 8, 9, 10, 15, 16]
+
+    for _ in range(150):
+        is_expense = rng.random() < 0.7
+        amount = 2 * rng.randint(50, 5000)
+        account_id = rng.choice([1, 2, 3])
+        categories = rng.sample(expenses if is_expense else incomes, rng.randint(1, 2))
+        post('/api/transactions/add', dict(
+            account_id=account_id, currency_id=1 + (account_id - 1) // 2, amount=amount,
+            date_issued=f'20{rng.randint(19, 23)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T12:00:00',
+            is_expense=is_expense, agent=f'agent{rng.randint(0, 7)}', comment='', direct=True,
+            flows=[], records=[
+                dict(amount=amount // len(categories), category_id=category_id)
+                for category_id in categories
+            ]))
+    return client
@@ -0,0 +1,20 @@
+from finnance.indexes.indexes import hot_queries, plan, statements
+from finnance.models import Account, Currency, User
+
+# tables that grow with the transactions, a full scan of them is a regression
+BIG_TABLES = {'trans', 'record', 'flow', 'ledger', 'monthly_total', 'agent_usage'}
+
+def test_hot_queries_use_their_indexes(app, client):
+    with app.app_context():
+        user = User.query.filter_by(username='finn').one()
+        account = Account.query.filter_by(user_id=user.id).first()
+        currency = Currency.query.filter_by(user_id=user.id).first()
+        for url, expected in hot_queries(account, currency):
+            plans = [plan(sql, parameters) for sql, parameters in statements(user, url)]
+            for table, indexes in expected.items():
+                used = [used[table] for used in plans if table in used]
+                assert used, f"{url}: {table} is not queried"
+                assert set(used) <= indexes, f"{url}: {table} uses {used}, expected {indexes}"
+            for used in plans:
+                scanned = {table for table, index in used.items() if index is None}
+                assert not scanned & BIG_TABLES, f"{url}: full scan of {scanned & BIG_TABLES}"
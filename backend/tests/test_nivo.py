@@ -0,0 +1,122 @@
+from datetime import datetime
+
+import pytest
+import sqlalchemy
+from finnance import db
+from finnance.models import Agent, Category, Currency, Record, Transaction
+
+# the charts used to be built with one query per category, these are those
+# implementations as reference for the aggregated ones
+
+def legacy_sunburst(user_id, currency, is_expense, min_date, max_date):
+    def agents(cat, path):
+        query = Agent.query.join(Transaction).join(Record).join(Category
+            ).filter(Transaction.currency_id == currency.id).filter(Category.id == cat.id)
+        query = query.filter(Transaction.date_issued >= min_date, Transaction.date_issued < max_date)
+        query = query.group_by(Agent).with_entities(
+            sqlalchemy.func.sum(Record.amount).label('value'), Agent.desc.label('name'))
+        return [
+            dict(color=cat.color, id=f'{path}.{row.name}', **row._asdict())
+            for row in query
+        ]
+
+    def cat_obj(cat, path=''):
+        cat_children = Category.query.filter_by(
+            parent_id=cat.id, user_id=user_id).order_by(Category.order).all()
+        path = f'{path}.{cat.desc}'
+        return {
+            'id': path,
+            'name': cat.desc,
+            'color': cat.color,
+            'children': [cat_obj(ch, path=path) for ch in cat_children] + agents(cat, path),
+        }
+
+    data = [
+        cat_obj(cat) for cat in Category.query.filter_by(
+            parent_id=None, user_id=user_id, is_expense=is_expense).order_by(Category.order)
+    ]
+    return {'id': 'sunburst', 'color': '#ff0000', 'children': data}
+
+def legacy_bars(user_id, currency, is_expense, min_date, max_date):
+    def value(cat):
+        row = Category.query.filter_by(id=cat.id).join(Record).join(
+            Transaction).filter_by(currency_id=currency.id).filter(
+            Transaction.date_issued >= min_date, Transaction.date_issued < max_date
+        ).group_by(Category).with_entities(
+            sqlalchemy.func.sum(Record.amount).label('value')).first()
+        return 0 if row is None else row.value
+
+    keys, values, bar_totals = [], [], {}
+
+    def bar_obj(cat):
+        bar = {'category': cat.desc, 'color': cat.color}
+
+        def children(parent):
+            prev_sum = sum(values)
+            v = value(parent)
+            if v > 0:
+                keys.append(parent.desc)
+                values.append(v)
+                bar[parent.desc] = v
+                bar[f"{parent.desc}_color"] = parent.color
+            for child in Category.query.filter_by(
+                    parent_id=parent.id, user_id=user_id).order_by(Category.order):
+                children(child)
+            if parent.parent is None:
+                bar_totals[parent.desc] = sum(values) - prev_sum
+
+        children(cat)
+        return None if len(bar) == 2 else bar
+
+    data = []
+    for cat in Category.query.filter_by(
+            parent_id=None, user_id=user_id, is_expense=is_expense).order_by(Category.order):
+        bar = bar_obj(cat)
+        if bar is not None:
+            data.append(bar)
+
+    for key in keys:
+        for bar in data:
+            if key not in bar:
+                bar[key] = 0
+                bar[f"{key}_color"] = Category.query.filter_by(
+                    desc=key, is_expense=is_expense, user_id=user_id).first().color
+
+    big3 = [k for k, _ in sorted(bar_totals.items(), key=lambda kv: kv[1], reverse=True)[:3]]
+    if len(data) > 3:
+        other = {'category': 'other', 'color': '#555555'}
+        for bar in data:
+            if bar['category'] not in big3:
+                for key in bar:
+                    if key in ('color', 'category'):
+                        continue
+                    elif key.endswith('_color'):
+                        other[key] = bar[key]
+                    else:
+                        other[key] = other.get(key, 0) + bar[key]
+        data.append(other)
+    data = [bar for bar in data if bar['category'] in big3 + ['other']]
+    return {'data': data, 'keys': keys, 'total': sum(values)}
+
+RANGES = [
+    ('2019-01-01', '2024-01-01'),
+    ('2021-03-15', '2022-08-01'),
+    ('2022-05-03', '2022-05-20'),
+    ('2020-02-01', '2020-03-01'),
+    ('2000-01-01', '2030-01-01'),
+]
+
+@pytest.mark.parametrize('chart, legacy', [('sunburst', legacy_sunburst), ('bars', legacy_bars)])
+@pytest.mark.parametrize('min_date, max_date', RANGES)
+@pytest.mark.parametrize('currency_id', [1, 2])
+@pytest.mark.parametrize('is_expense', [True, False])
+def test_matches_legacy(app, client, chart, legacy, min_date, max_date, currency_id, is_expense):
+    response = client.get(
+        f'/api/nivo/{chart}?currency_id={currency_id}&is_expense={str(is_expense).lower()}'
+        f'&min_date={min_date}T00:00:00&max_date={max_date}T00:00:00')
+    assert response.status_code == 200
+    with app.app_context():
+        currency = db.session.get(Currency, currency_id)
+        expected = legacy(currency.user_id, currency, is_expense,
+                          datetime.fromisoformat(min_date), datetime.fromisoformat(max_date))
+    assert response.get_json() == expected
@@ -291,6 +291,7 @@ export interface useTransactionsProps extends FilterRequest {
 interface useTransactionsReturn {
     transactions: TransactionDeepQueryResult[]
     pages: number
+    next_cursor: string | null
 }
 
 export const useTransactions = (props: useTransactionsProps) =>